@@ -1,164 +1,495 @@
 #!/usr/bin/python3
 """Compressed Thoughts blog, by Matthew Rease."""
+# pylint: disable=too-many-lines
 
+import functools
+import gzip
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import queue
 import threading
-from collections import Counter
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from os import environ
+from urllib.parse import urlencode
 
-import markdown
 import MySQLdb
 from dotenv import load_dotenv
-from flask import Flask, render_template, Response
-from PIL import Image
+from flask import Flask, make_response, render_template, request, Response, send_from_directory
 
+import assets
 import config
-from md_ext import HeadingShiftExtension, HeadingLinkExtension
+import metrics
+from cache import LRUCache, open_backend, RefreshingValue
+from images import ImageIndex, variant_path
+from popularity import PopularityCounter
+from search import SearchIndex
 
 load_dotenv()
 
-TWO_HOUR_DELTA = timedelta(hours = 2)
+CACHE_DELTA = timedelta(hours = float(environ.get('CACHE_HOURS', '2')))
+CHANGE_POLL_DELTA = timedelta(seconds = float(environ.get('CHANGE_POLL_SECONDS', '60')))
 
-class DBContextManager:
+class Post:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Everything about a single post, including its author's name and its tags."""
+
+    __slots__ = (
+        'post_id', 'author', 'title', 'description', 'preview', 'content',
+        'published', 'modified', 'filename', 'image_alt', 'tags')
+
+    def __init__(self, row: tuple):
+        """Unpack a row selected by DBContextManager.query_posts."""
+        (
+            self.post_id,
+            self.author,
+            self.title,
+            self.description,
+            self.preview,
+            self.content,
+            self.published,
+            self.modified,
+            self.filename,
+            self.image_alt,
+            tags
+        ) = row
+        self.tags = tags.split('\n') if tags else []
+
+# The page's posts are picked first (walking the filename index, and only up to the LIMIT), and
+# only those rows are joined with their author and tags
+# pylint: disable=line-too-long
+POSTS_QUERY = """
+    SELECT Post.post_id, User.name, Post.title, Post.description, Post.preview, Post.content, Post.published, Post.modified, Post.filename, Post.image, GROUP_CONCAT(Tag.name SEPARATOR '\\n')
+    FROM (
+        SELECT Post.post_id, Post.user_id, Post.title, Post.description, Post.preview, {content}, Post.published, Post.modified, Post.filename, Post.image
+        FROM Post {where}
+        ORDER BY Post.filename DESC
+        {limit}) AS Post
+    JOIN User ON Post.user_id = User.user_id
+    LEFT JOIN PostTag ON Post.post_id = PostTag.post_id
+    LEFT JOIN Tag ON PostTag.tag_id = Tag.tag_id
+    GROUP BY Post.post_id
+    ORDER BY Post.filename DESC;"""
+# pylint: enable=line-too-long
+
+def posts_query(where: str, limit: str = '', full: bool = True) -> str:
+    """Fill in POSTS_QUERY, leaving out the posts' contents (as empty strings) unless full."""
+    return POSTS_QUERY.format(
+        where=where,
+        limit=limit,
+        content='Post.content' if full else "'' AS content")
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of MySQL connections."""
+
+    def __init__(self, credentials: dict, size: int, ping_interval: float):
+        """Prepare an empty pool, connections are opened on demand."""
+        self.credentials = credentials
+        self.ping_interval = ping_interval
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()  # (connection, last used) pairs
+        self.lock = threading.Lock()
+        self.connections = set()
+
+    def close(self):
+        """Close every connection owned by the pool."""
+        while True:
+            try:
+                self.idle.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            for db in self.connections:
+                try:
+                    db.close()
+                except MySQLdb.Error:
+                    pass
+            self.connections.clear()
+
+    def connect(self):
+        """Open a new connection using the pool's credentials."""
+        db = MySQLdb.connect(
+            host=self.credentials['host'],
+            user=self.credentials['user'],
+            password=self.credentials['password'],
+            database=self.credentials['database'])
+        cursor = db.cursor()
+        cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED;')
+        cursor.close()
+        with self.lock:
+            self.connections.add(db)
+        return db
+
+    def discard(self, db):
+        """Close a connection and forget about it."""
+        with self.lock:
+            self.connections.discard(db)
+        try:
+            db.close()
+        except MySQLdb.Error:
+            pass
+
+    def checkout(self):
+        """Get an idle connection (health checked if it sat for a while), or open a new one."""
+        while True:
+            try:
+                db, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if time.monotonic() - last_used < self.ping_interval:
+                return db
+            try:
+                db.ping()
+                return db
+            except MySQLdb.OperationalError:
+                redlog('Dropping stale database connection from pool.')
+                self.discard(db)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, blocking while all of them are in use.
+
+        Connections are closed instead of being returned to the pool if anything goes wrong while
+        they are borrowed, as they may be left in an unknown state.
+        """
+        with self.slots:
+            db = self.checkout()
+            try:
+                yield db
+            except BaseException:
+                self.discard(db)
+                raise
+            self.idle.put((db, time.monotonic()))
+
+class DBContextManager:  # pylint: disable=too-many-public-methods
     """Simple way to track database connection and variables."""
 
     def __init__(self):
-        """Create persistent Blog MySQL database connection and establish cache."""
+        """Create Blog MySQL database connection pool and establish cache."""
         self.credentials = {
             'host': environ.get('MYSQL_HOST', 'localhost'),
             'user': environ.get('MYSQL_USER', 'blog'),
             'password': environ.get('MYSQL_PASSWORD', 'blog'),
             'database': environ.get('MYSQL_DATABASE', 'blog') }
 
-        self.db = None
-        self.cursor = None
-        self.lock = threading.Lock()
-        self.connect()
+        self.pool = ConnectionPool(
+            self.credentials,
+            int(environ.get('MYSQL_POOL_SIZE', '4')),
+            float(environ.get('MYSQL_POOL_PING', '30')))
 
 
-        _2ha = datetime.now() - TWO_HOUR_DELTA
+        self.backend = open_backend(environ.get('CACHE_BACKEND', ''))
         self.cache = {
-            'all_posts': {},
-            'all_posts_req': _2ha,
+            'all_posts': RefreshingValue(self.load_all_posts_sidebar, CACHE_DELTA, self.backend, 'all_posts'),  # pylint: disable=line-too-long
+            'archive': (None, {}),
+            'filenames': (None, []),
+
+            'top_tags': RefreshingValue(self.load_top_tags, CACHE_DELTA, self.backend, 'top_tags'),
 
-            'top_tags': [],
-            'top_tags_req': _2ha,
+            'tag_index': RefreshingValue(self.load_tag_index, CACHE_DELTA, self.backend, 'tag_index'),  # pylint: disable=line-too-long
+            'post_tags': (None, {}),
+            'tags_digest': (None, ''),
+            'tag_matches': LRUCache(100000, sizeof=lambda filenames: len(filenames) + 1),
 
-            'users': {},
+            'posts': LRUCache(
+                int(environ.get('POST_CACHE_BYTES', str(16 * 1024 * 1024))),
+                sizeof=lambda post: len(post.content) + 1),
 
-            'post_count': 0,
-            'post_count_req': _2ha
+            'fingerprint': RefreshingValue(
+                self.load_fingerprint,
+                CHANGE_POLL_DELTA,
+                self.backend,
+                'fingerprint',
+                on_change=self.invalidate)
         }
+        self.search_index = SearchIndex(environ.get('SEARCH_INDEX', 'search.json'))
 
     def __del__(self):
         """Close database connections."""
-        self.cursor.close()
-        self.db.close()
-
-    def connect(self):
-        """Connect to database using environment variables."""
-        self.db = MySQLdb.connect(
-            host=self.credentials['host'],
-            user=self.credentials['user'],
-            password=self.credentials['password'],
-            database=self.credentials['database'])
-        self.cursor = self.db.cursor()
-        self.cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED;')
+        self.pool.close()
 
     def execute(self, query: str, tokens: tuple) -> tuple:
-        """Dumb wrapper for MySQLdb.cursor.execute."""
+        """Dumb wrapper for MySQLdb.cursor.execute, using a pooled connection."""
         try:
-            with self.lock:
-                redlog(f'executing query {query}')
-                self.cursor.execute(query, tokens)
-                return self.cursor.fetchall()
+            with self.pool.connection() as db:
+                if log_sql:
+                    redlog(f'executing query {query}')
+                cursor = db.cursor()
+                try:
+                    with metrics.timed('query'):
+                        cursor.execute(query, tokens)
+                        return cursor.fetchall()
+                finally:
+                    cursor.close()
         except MySQLdb.OperationalError as _e:
             if _e.args[0] == 2006:
+                # The pool already threw away the dead connection.
                 redlog('Lost database connection, attempting reconnect.')
-                self.connect()
                 return self.execute(query, tokens)
             raise
 
+    def load_all_posts_sidebar(self):
+        """Query short-form dict of every post."""
+        return {
+            row[2]: {
+                'title': row[0],
+                'description': row[1],
+                'alt': row[3],
+                'published': row[4],
+                'modified': row[5]
+            }
+            for row in self.execute(
+                'SELECT title, description, filename, image, published, modified FROM Post ORDER BY filename DESC',  # pylint: disable=line-too-long
+                tuple())}
+
     def get_all_posts_sidebar(self):
         """Get short-form dict of every post (with cache)."""
-        now = datetime.now()
-        if now - self.cache['all_posts_req'] > TWO_HOUR_DELTA:
-            self.cache['all_posts_req'] = now
-            self.cache['all_posts'] = {
-                row[2]: {
-                    'title': row[0],
-                    'description': row[1],
-                    'alt': row[3],
-                    'published': row[4],
-                    'modified': row[5]
-                }
-                for row in self.execute(
-                    'SELECT title, description, filename, image, published, modified FROM Post ORDER BY filename DESC',  # pylint: disable=line-too-long
-                    tuple())}
-        return self.cache['all_posts']
+        return self.cache['all_posts'].get()
 
     def generate_archive_dict(self):
-        """Split flat dictionary of posts into one sorted by year and then month."""
+        """Split flat dictionary of posts into one sorted by year and then month (with cache).
+
+        Rebuilt in a single pass whenever the sidebar posts are refreshed.
+        """
         posts = self.get_all_posts_sidebar()
-        res = {}
-        for year in range(datetime.now().year, 2019, -1):
-            year = str(year)
-            y_posts = {}
-            for month in range(1, 13):
-                month = str(month).zfill(2)
-                m_posts = {
-                    _id[6:]: post
-                    for _id, post in posts.items()
-                    if _id[0:4] == year and _id[4:6] == month }
-                if m_posts:
-                    y_posts[month] = m_posts
-            if y_posts:
-                res[year] = y_posts
-        return res
+        source, archive = self.cache['archive']
+        if source is not posts:
+            res = {}
+            for _id in self.get_post_filenames():
+                res.setdefault(_id[0:4], {}).setdefault(_id[4:6], {})[_id[6:]] = posts[_id]
+            # Months are listed oldest first, the template reverses them
+            archive = { year: dict(reversed(months.items())) for year, months in res.items() }
+            self.cache['archive'] = (posts, archive)
+        return archive
+
+    def get_post_filenames(self):
+        """Get filenames of every post, newest first (with cache)."""
+        posts = self.get_all_posts_sidebar()
+        source, filenames = self.cache['filenames']
+        if source is not posts:
+            filenames = sorted(posts, reverse=True)
+            self.cache['filenames'] = (posts, filenames)
+        return filenames
+
+    def load_top_tags(self):
+        """Query most common post tags."""
+        return [row[0] for row in self.execute("""
+            SELECT Tag.name, COUNT(DISTINCT PostTag.post_id) AS post_count
+            FROM PostTag
+            JOIN Tag on PostTag.tag_id = Tag.tag_id
+            GROUP BY Tag.name
+            ORDER BY post_count DESC
+            LIMIT 15""",
+            tuple())]
 
     def get_top_tags(self):
         """Get most common post tags (with cache)."""
-        now = datetime.now()
-        if now - self.cache['top_tags_req'] > TWO_HOUR_DELTA:
-            self.cache['top_tags_req'] = now
-            self.cache['top_tags'] = [row[0] for row in context.execute("""
-                SELECT Tag.name, COUNT(DISTINCT PostTag.post_id) AS post_count
-                FROM PostTag
-                JOIN Tag on PostTag.tag_id = Tag.tag_id
-                GROUP BY Tag.name
-                ORDER BY post_count DESC
-                LIMIT 15""",
-                tuple())]
-        return self.cache['top_tags']
-
-    def get_user(self, user_id):
-        """Retrieve the name of the user with given ID."""
-        if user_id not in self.cache['users']:
-            self.cache['users'][user_id] = self.execute(
-                'SELECT name FROM User WHERE user_id = %s;',
-                (user_id,))[0][0]
-        return self.cache['users'][user_id]
-
-    def get_post_count(self):
-        """Get total number of blog posts."""
-        now = datetime.now()
-        if now - self.cache['post_count_req'] > TWO_HOUR_DELTA:
-            self.cache['post_count_req'] = now
-            self.cache['post_count'] = self.execute('SELECT COUNT(*) FROM Post;', tuple())[0][0]
-        return self.cache['post_count']
+        return self.cache['top_tags'].get()
+
+    def load_tag_index(self):
+        """Query which posts use each tag, as a dict of tag name to set of filenames."""
+        tag_index = {}
+        for name, filename in self.execute("""
+            SELECT Tag.name, Post.filename
+            FROM PostTag
+            JOIN Tag ON PostTag.tag_id = Tag.tag_id
+            JOIN Post ON PostTag.post_id = Post.post_id""",
+            tuple()):
+            tag_index.setdefault(name, set()).add(filename)
+        return tag_index
+
+    def get_post_tags(self) -> dict[str, frozenset[str]]:
+        """Get each post's tag names, by filename (with cache).
+
+        Rebuilt from the tag index whenever it is refreshed.
+        """
+        tag_index = self.cache['tag_index'].get()
+        source, post_tags = self.cache['post_tags']
+        if source is not tag_index:
+            res = {}
+            for name, filenames in tag_index.items():
+                for filename in filenames:
+                    res.setdefault(filename, set()).add(name)
+            post_tags = { filename: frozenset(names) for filename, names in res.items() }
+            self.cache['post_tags'] = (tag_index, post_tags)
+        return post_tags
+
+    def get_tags_digest(self) -> str:
+        """Get a checksum of every post's tags, the same in every worker (with cache)."""
+        post_tags = self.get_post_tags()
+        source, digest = self.cache['tags_digest']
+        if source is not post_tags:
+            digest = hashlib.sha1(repr(sorted(
+                (filename, sorted(names)) for filename, names in post_tags.items())).encode()).hexdigest()  # pylint: disable=line-too-long
+            self.cache['tags_digest'] = (post_tags, digest)
+        return digest
+
+    def find_tagged_posts(self, tag_filter: str) -> list[str]:
+        """Get filenames of posts with a tag containing tag_filter, newest first (with cache).
+
+        Same matching as LOWER(Tag.name) LIKE '%filter%', but done against the in-memory tag index.
+        """
+        tag_filter = tag_filter.lower()
+        tag_index = self.cache['tag_index'].get()
+        key = (self.cache['tag_index'].version, tag_filter)
+        filenames = self.cache['tag_matches'].get(key)
+        if filenames is None:
+            matches = set()
+            for name, posts in tag_index.items():
+                if tag_filter in name.lower():
+                    matches |= posts
+            filenames = sorted(matches, reverse=True)
+            self.cache['tag_matches'].put(key, filenames)
+        return filenames
+
+    def store_posts(self, rows: tuple) -> list[Post]:
+        """Turn rows selected with POSTS_QUERY into posts, and cache them."""
+        posts = [Post(row) for row in rows]
+        for post in posts:
+            self.cache['posts'].put(post.filename, post)
+        return posts
+
+    def query_posts(self, where: str, tokens: tuple, limit: str = '', full: bool = True) -> list[Post]:  # pylint: disable=line-too-long
+        """Load posts with their author and tags in a single query, newest first.
+
+        Only full posts are cached, listings leave out the contents.
+        """
+        rows = self.execute(posts_query(where, limit, full), tokens)
+        return self.store_posts(rows) if full else [Post(row) for row in rows]
+
+    def cached_posts(self, filenames: list[str]) -> tuple[dict[str, Post], list[str]]:
+        """Split filenames into posts found in the cache, and filenames that need to be queried.
+
+        Cached posts are reused as long as their modified time matches the sidebar cache, and their
+        tags match the tag index (tagging a post doesn't change its modified time).
+        """
+        all_posts = self.get_all_posts_sidebar()
+        post_tags = self.get_post_tags()
+        found = {}
+        missing = []
+        for filename in filenames:
+            post = self.cache['posts'].get(filename)
+            if (
+                post is not None
+                and filename in all_posts
+                and post.modified == all_posts[filename]['modified']
+                and set(post.tags) == post_tags.get(filename, set())
+            ):
+                found[filename] = post
+            else:
+                missing.append(filename)
+        return found, missing
+
+    def get_posts(self, filenames: list[str]) -> list[Post]:
+        """Get posts by filename, in the given order, skipping any that don't exist (with cache)."""
+        found, missing = self.cached_posts(filenames)
+        if missing:
+            for post in self.query_posts(
+                    f"WHERE Post.filename IN ({', '.join(['%s'] * len(missing))})",
+                    tuple(missing)):
+                found[post.filename] = post
+        return [found[filename] for filename in filenames if filename in found]
+
+    def get_post(self, filename: str) -> Post | None:
+        """Get a single post by filename (with cache)."""
+        posts = self.get_posts([filename])
+        return posts[0] if posts else None
+
+    def load_search_fields(self, filenames: list[str]):
+        """Query the searchable text of posts, a hundred at a time."""
+        for start in range(0, len(filenames), 100):
+            batch = filenames[start:start + 100]
+            for post in self.query_posts(
+                    f"WHERE Post.filename IN ({', '.join(['%s'] * len(batch))})",
+                    tuple(batch)):
+                yield post.filename, {
+                    'title': post.title,
+                    'tags': ' '.join(post.tags),
+                    'description': post.description,
+                    'preview': post.preview,
+                    'content': post.content
+                }
+
+    def update_search_index(self):
+        """Index posts published, edited or tagged since the sidebar posts or tags were last refreshed."""  # pylint: disable=line-too-long
+        posts = self.get_all_posts_sidebar()
+        post_tags = self.get_post_tags()
+        source = (posts, post_tags)
+        if source != self.search_index.source:
+            self.search_index.update(
+                source,
+                {
+                    filename: ' '.join([post['modified'].isoformat(), *sorted(post_tags.get(filename, ()))])  # pylint: disable=line-too-long
+                    for filename, post in posts.items()
+                },
+                self.load_search_fields)
+
+    def search_posts(self, query: str) -> list[str]:
+        """Get filenames of posts matching a full-text search query, best match first."""
+        self.update_search_index()
+        return self.search_index.search(query)
+
+    def load_fingerprint(self):
+        """Query something cheap that changes whenever a post is published, edited or re-tagged.
+
+        Tags are summed up with order-independent checksums of every post/tag pair and every tag
+        name, so swapping one of a post's tags for another, or renaming a tag, is noticed too.
+        """
+        return self.execute("""
+            SELECT
+                MAX(modified),
+                COUNT(*),
+                (SELECT COUNT(*) FROM PostTag),
+                (SELECT COALESCE(SUM(CRC32(CONCAT(post_id, ':', tag_id))), 0) FROM PostTag),
+                (SELECT COALESCE(SUM(CRC32(CONCAT(tag_id, ':', name))), 0) FROM Tag)
+            FROM Post;""",
+            tuple())[0]
+
+    def check_for_changes(self):
+        """Poll the fingerprint (in the background, every CHANGE_POLL_SECONDS), invalidating caches when it changes."""  # pylint: disable=line-too-long
+        self.cache['fingerprint'].get()
+
+    def invalidate(self):
+        """Expire every cache derived from the Post table, so they are refreshed in the background.
+
+        Rendered Markdown, feeds and pages are keyed on the posts' modified times and tags, and
+        these caches' versions, so they follow along by themselves.
+        """
+        for name in ('all_posts', 'top_tags', 'tag_index'):
+            self.cache[name].invalidate()
 
 # For Flask
 app = Flask(__name__)
 context = DBContextManager()
 
-# For uWSGI
-application = app
+assets.load_manifest()
+app.jinja_env.globals['asset_url'] = assets.url
+
+image_index = ImageIndex('static/images')
+
+def image_srcset(image_id: str) -> str:
+    """srcset attribute listing every available size of a post image."""
+    info = image_index.get(image_id)
+    if info is None:
+        return ''
+    return ', '.join([
+        *(
+            f"{assets.url(variant_path('images', image_id, width))} {width}w"
+            for width in info['variants']),
+        f"{assets.url(f'images/{image_id}.webp')} {info['width']}w"])
+
+app.jinja_env.globals['image_srcset'] = image_srcset
 
 def redlog(msg):
     """Print red text to log (easily distinguished from Flask logging)."""
     print(f'\x1b[31m{msg}\x1b[0m')
 
+log_sql = environ.get('LOG_LEVEL', 'info').lower() == 'debug'
 use_csp = environ.get('USE_CSP').lower() == 'true'
+use_tag_index = environ.get('USE_TAG_INDEX', 'true').lower() == 'true'
 http500_db_metadata = {
     'config': config,
     'now': datetime.now(),
@@ -216,12 +547,41 @@ http404_post_metadata = {
         'date': '20200202',
         'time': '00:00:00'
     },
-    'content': markdown.markdown('If you think this is an error, then feel free to contact me about it.')  # pylint: disable=line-too-long
-}
-popular_posts = {
-    'last_check': datetime.now() - TWO_HOUR_DELTA,
-    'data': []
+    'content': '<p>If you think this is an error, then feel free to contact me about it.</p>'
 }
+popularity = PopularityCounter(
+    'access.log',
+    environ.get('POPULARITY_STATE', 'popularity.json'),
+    int(environ.get('POPULARITY_DAYS', '7')))
+POPULARITY_DELTA = timedelta(minutes = int(environ.get('POPULARITY_MINUTES', '5')))
+
+def load_popular_posts() -> list[str]:
+    """Count new log lines and pick the most popular posts."""
+    try:
+        popularity.refresh()
+    except FileNotFoundError as _e:
+        print(_e)
+        redlog("Please create a log file with the designated log format, even if you won't use it, to minimize work on the server!")  # pylint: disable=line-too-long
+    return popularity.most_common(3)
+
+popular_posts = RefreshingValue(
+    load_popular_posts, POPULARITY_DELTA, context.backend, 'popular_posts')
+
+markdown_cache = LRUCache(
+    int(environ.get('MARKDOWN_CACHE_BYTES', str(8 * 1024 * 1024))),
+    environ.get('MARKDOWN_CACHE_DIR') or None)
+
+def render_post_markdown(filename: str, modified: datetime, content: str) -> str:
+    """Render the body of a post to HTML, reusing earlier output until the post is modified."""
+    key = (filename, modified.isoformat())
+    md_body = markdown_cache.get(key)
+    if md_body is None:
+        # Imported here so starting a worker doesn't have to wait for the Markdown library
+        import md_ext  # pylint: disable=import-outside-toplevel
+        with metrics.timed('markdown'):
+            md_body = md_ext.convert(content)
+        markdown_cache.put(key, md_body)
+    return md_body
 
 def get_top_tags(tag_filter: str) -> list[str]:
     """Generate list of the most used tags, including the current filter and an empty tag."""
@@ -234,78 +594,319 @@ def get_top_tags(tag_filter: str) -> list[str]:
     return top_tags
 
 def get_popular_posts() -> list[str]:
-    """Generate list of popular posts from log, and cache."""
-    now = datetime.now()
-    if now - popular_posts['last_check'] > TWO_HOUR_DELTA:
-        popular_posts['last_check'] = now
+    """Generate list of popular posts from log (with cache)."""
+    return popular_posts.get() or [] # [ '202002101957', '202002261145', '202004161413' ]
+
+MONTH_NAMES = {
+    '01': 'January',
+    '02': 'February',
+    '03': 'March',
+    '04': 'April',
+    '05': 'May',
+    '06': 'June',
+    '07': 'July',
+    '08': 'August',
+    '09': 'September',
+    '10': 'October',
+    '11': 'November',
+    '12': 'December'
+}
+fragment_cache = LRUCache(int(environ.get('FRAGMENT_CACHE_BYTES', str(4 * 1024 * 1024))))
+
+def render_fragment(template: str, key: tuple, build) -> str:
+    """Render a template with the metadata returned by build, unless key was already rendered."""
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render_template(template, metadata=build())
+        fragment_cache.put(key, html)
+    return html
+
+def sidebar_metadata(tags: list[str], tag_filter: str) -> dict[str, str]:
+    """Pre-rendered HTML for the popular posts, archive and tags sections of the sidebar."""
+    context.get_all_posts_sidebar()  # Loads the posts if needed, so the version below is current
+    all_posts_version = context.cache['all_posts'].version
+    popular = get_popular_posts()
+
+    def build_popular():
+        all_posts = context.get_all_posts_sidebar()
+        return {
+            'popular': [
+                {
+                    'id': id,
+                    'image': assets.url(f'images/{id}.webp'),
+                    'image_alt': all_posts[id]['alt'],
+                    'title': all_posts[id]['title'],
+                    'description': all_posts[id]['description']
+                }
+                for id in popular
+                if id in all_posts]  # Skip posts deleted since they were popular
+        }
+
+    return {
+        'sidebar_popular': render_fragment(
+            'sidebar_popular.html',
+            ('popular', all_posts_version, tuple(popular)),
+            build_popular),
+        'sidebar_archive': render_fragment(
+            'sidebar_archive.html',
+            ('archive', all_posts_version),
+            lambda: { 'archive': context.generate_archive_dict(), 'month_names': MONTH_NAMES }),
+        'sidebar_tags': render_fragment(
+            'sidebar_tags.html',
+            ('tags', tuple(tags), tag_filter),
+            lambda: { 'tags': tags, 'filter': tag_filter })
+    }
+
+page_cache = LRUCache(
+    int(environ.get('PAGE_CACHE_BYTES', str(32 * 1024 * 1024))),
+    sizeof=lambda entry: len(entry[2]))
+
+def content_version() -> tuple[str, datetime]:
+    """Fingerprint everything a rendered page depends on, and when posts last changed."""
+    all_posts = context.get_all_posts_sidebar()
+    last_modified = max(
+        (post['modified'] for post in all_posts.values()),
+        default=datetime.fromtimestamp(0))
+    version = hashlib.sha1(repr((
+        last_modified,
+        sorted(all_posts),
+        get_popular_posts(),
+        context.get_top_tags(),
+        context.get_tags_digest())).encode()).hexdigest()
+    return version, last_modified.astimezone()
+
+def cached_page(view):
+    """Serve a view from the page cache, answering conditional requests with 304 Not Modified."""
+    @functools.wraps(view)
+    def wrapper(**kwargs):
         try:
-            with open('access.log', 'r', encoding='utf-8') as log:
-                new_data = Counter()
-                for line in log.read().splitlines():
-                    if 'GET 200 /post/' in line:
-                        new_data[line.split()[3][6:]] += 1
-                popular_posts['data'] = [key for key, _ in new_data.most_common(3)]
-        except FileNotFoundError as _e:
-            print(_e)
-            redlog("Please create a log file with the designated log format, even if you won't use it, to minimize work on the server!")  # pylint: disable=line-too-long
-        #print(new_data)
-    #print(popular_posts)
-    return popular_posts['data'] or [] # [ '202002101957', '202002261145', '202004161413' ]
+            version, last_modified = content_version()
+        except MySQLdb.OperationalError:
+            return view(**kwargs)  # Let the view deal with the database
+        etag = hashlib.sha1(f'{request.path}:{version}'.encode()).hexdigest()
+
+        entry = page_cache.get(request.path)
+        if entry is None or entry[0] != etag:
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            entry = (etag, response.mimetype, response.get_data())
+            page_cache.put(request.path, entry)
+
+        response = Response(entry[2], mimetype=entry[1])
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
+metrics.init_app(
+    app,
+    environ.get('SERVER_TIMING', 'false').lower() == 'true',
+    environ.get('METRICS_TOKEN', ''))
+for _name in ('all_posts', 'top_tags', 'tag_index', 'tag_matches', 'posts'):
+    metrics.register_cache(_name, context.cache[_name])
+metrics.register_cache('popular_posts', popular_posts)
+metrics.register_cache('markdown', markdown_cache)
+metrics.register_cache('fragments', fragment_cache)
+metrics.register_cache('pages', page_cache)
+
+@app.before_request
+def check_for_changes():
+    """Notice new or edited posts without waiting for the caches to expire."""
+    try:
+        context.check_for_changes()
+    except MySQLdb.OperationalError:
+        pass  # The view will show the database error page
 
 # Handle Pages
+@app.route('/invalidate', methods=['POST'])
+def invalidate():
+    """Refresh cached posts right away, e.g. after publishing (needs INVALIDATE_TOKEN as a bearer token)."""  # pylint: disable=line-too-long
+    token = environ.get('INVALIDATE_TOKEN', '')
+    if (not token or request.remote_addr not in ('127.0.0.1', '::1')
+            or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')):
+        return Response('Not Found', status=404)
+    context.invalidate()
+    return Response('Caches invalidated\n', mimetype='text/plain')
+
+@app.route('/static/dist/<path:filename>')
+def hashed_asset(filename):
+    """Serve a content-hashed asset (pre-compressed if possible), which may be cached forever."""
+    directory = os.path.abspath(assets.DIST)
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(directory, filename + suffix)):  # pylint: disable=line-too-long
+            response = send_from_directory(
+                directory,
+                filename + suffix,
+                mimetype=mimetypes.guess_type(filename)[0])
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = None  # Set by send_from_directory
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+def main_post_metadata(post: Post) -> dict:
+    """Jinja metadata for a post listed on the main page."""
+    return {
+        'id': post.filename,
+        'image': assets.url(f'images/{post.filename}.webp'),
+        'image_alt': post.image_alt,
+        'title': post.title,
+        'description': post.description,
+        'preview': post.preview,
+        'author': post.author,
+        'published': post.published.astimezone().replace(microsecond=0).isoformat(),
+        'modified': post.modified.astimezone().replace(microsecond=0).isoformat(),
+        'datestr': post.published.strftime('%b %d, %Y')
+    }
+
+def index_queries(tag_filter: str, page: int) -> tuple[str, tuple, int | None, tuple | None]:
+    """Plan the queries of a main page.
+
+    Returns the WHERE clause and tokens selecting the page's posts with posts_query (and LIMIT 5
+    OFFSET %s), and the last page number. When the number of posts can only be counted by MySQL, the
+    last page number is None and a (query, tokens) pair counting them is returned as well.
+    """
+    if tag_filter == '':
+        # Seek to the first post of the page instead of making MySQL skip over an OFFSET
+        filenames = context.get_post_filenames()
+        if page == 0:
+            where, tokens = '', (0,)
+        elif page * 5 < len(filenames):
+            where, tokens = 'WHERE Post.filename <= %s', (filenames[page * 5], 0)
+        else:
+            where, tokens = 'WHERE FALSE', (0,)
+        return where, tokens, (len(filenames) - 1) // 5, None
+    if use_tag_index:
+        filenames = context.find_tagged_posts(tag_filter)
+        page_filenames = filenames[page * 5:page * 5 + 5]
+        where = f"WHERE Post.filename IN ({', '.join(['%s'] * len(page_filenames))})" if page_filenames else 'WHERE FALSE'  # pylint: disable=line-too-long
+        return where, (*page_filenames, 0), (len(filenames) - 1) // 5, None
+    where = '''
+        WHERE Post.post_id IN (
+            SELECT PostTag.post_id
+            FROM PostTag
+            JOIN Tag ON Tag.tag_id = PostTag.tag_id
+            WHERE LOWER(Tag.name) LIKE %s)'''
+    count_query = """
+        SELECT COUNT(DISTINCT PostTag.post_id)
+        FROM PostTag
+        JOIN Tag ON Tag.tag_id = PostTag.tag_id
+        WHERE LOWER(Tag.name) LIKE %s;"""
+    return where, (f'%{tag_filter.lower()}%', page * 5), None, (count_query, (f'%{tag_filter.lower()}%',))  # pylint: disable=line-too-long
+
+def render_index(tag_filter: str, page: int, top_tags: list[str], last_page: int, posts: list[Post]) -> str:  # pylint: disable=line-too-long
+    """Render a main page listing posts."""
+    # All relevant data for Jinja template.
+    metadata = {
+        'config': config,
+        'now': datetime.now(),
+        'csp': use_csp,
+        'base': '',
+        'canonical': (
+            f"{'/' if tag_filter == '' and page == 0 else ''}"
+            f"{'' if tag_filter == '' else f'/filter/{tag_filter}'}"
+            f"{'' if page == 0 else f'/page/{page}'}"
+        ),
+        'tags': top_tags,
+        'filter': tag_filter,
+        **sidebar_metadata(top_tags, tag_filter),
+        'page': page,
+        'last': last_page,
+        'posts': [main_post_metadata(post) for post in posts],
+        'pages': list(range(max(0, page - 3), min(last_page + 1, page + 4)))
+    }
+    return render_template('index.html', metadata=metadata)
+
 @app.route('/')
 @app.route('/filter/<tag_filter>')
 @app.route('/page/<int:page>')
 @app.route('/filter/<tag_filter>/page/<int:page>')
+@cached_page
 def index(tag_filter='', page=0):
     """Generate main page, showing most recent posts (paginated)."""
     try:
         # Prereqs for Jinja metadata.
-        all_posts = context.get_all_posts_sidebar()
         top_tags = get_top_tags(tag_filter)
-        last_page = (context.get_post_count() - 1) // 5 if tag_filter == '' else (context.execute(
-            """
-            SELECT COUNT(DISTINCT PostTag.post_id)
-            FROM PostTag
-            JOIN Tag ON Tag.tag_id = PostTag.tag_id
-            WHERE LOWER(Tag.name) LIKE %s;""",
-            (f'%{tag_filter.lower()}%',))[0][0] - 1) // 5
+        where, tokens, last_page, count_query = index_queries(tag_filter, page)
+        if count_query is not None:
+            last_page = (context.execute(*count_query)[0][0] - 1) // 5
+        posts = context.query_posts(where, tokens, 'LIMIT 5 OFFSET %s', full=False)
+        return render_index(tag_filter, page, top_tags, last_page, posts)
+
+    except MySQLdb.OperationalError as _e:
+        if _e.args[0] == 2002:
+            redlog('Could not connect to database!')
+            return render_template('500_db.html', metadata=http500_db_metadata), 500
+        raise
+
+def render_post(post: Post | None) -> tuple[str, int]:
+    """Render a post's page (or the missing post page if it is None), and its status code."""
+    if post is None:  # Post does not exist
+        return render_template('404_post.html', metadata=http404_post_metadata), 404
+    filename = post.filename
+    image = image_index.get(filename) or { 'width': 0, 'height': 0 }
+    md_body = render_post_markdown(filename, post.modified, post.content)
+
+    # All relevant data for Jinja template.
+    metadata = {
+        'config': config,
+        'now': datetime.now(),
+        'csp': use_csp,
+        'base': f'post/{filename}',
+        'canonical': f'/post/{filename}',
+        'tags': post.tags,
+        'filter': '',
+        **sidebar_metadata(post.tags, ''),
+        'title': post.title,
+        'description': post.description,
+        'author': post.author,
+        'image': {
+            'url': assets.url(f'images/{filename}.webp'),
+            'srcset': image_srcset(filename),
+            'width': image['width'],
+            'height': image['height'],
+            'alt': post.image_alt
+        },
+        'preview': post.preview,
+        'published': post.published.astimezone().replace(microsecond=0).isoformat(),
+        'modified': post.modified.astimezone().replace(microsecond=0).isoformat(),
+        'content': md_body
+    }
+    return render_template('post.html', metadata=metadata), 200
+
+@app.route('/post/<int:post_id>')
+@cached_page
+def show_post(post_id):
+    """Show a post from the database."""
+    try:
+        return render_post(context.get_post(str(post_id)))
+
+    except MySQLdb.OperationalError as _e:
+        if _e.args[0] == 2002:
+            redlog('Could not connect to database!')
+            return render_template('500_db.html', metadata=http500_db_metadata), 500
+        raise
+
+@app.route('/search')
+def search():
+    """Show posts matching a full-text search of their titles, tags, descriptions and contents."""
+    query = request.args.get('q', '').strip()[:200]
+    page = max(request.args.get('page', 0, type=int), 0)
+    try:
+        # Prereqs for Jinja metadata.
+        top_tags = get_top_tags('')
+        filenames = context.search_posts(query)
+        last_page = (len(filenames) - 1) // 5
         main_posts = [
-            {
-                'id': filename,
-                'image': f'/static/images/{filename}.webp',
-                'image_alt': image_alt,
-                'title': title,
-                'description': description,
-                'preview': preview,
-                'author': author,
-                'published': published.astimezone().replace(microsecond=0).isoformat(),
-                'modified': modified.astimezone().replace(microsecond=0).isoformat(),
-                'datestr': published.strftime('%b %d, %Y')
-            }
-            for (
-                author,
-                title,
-                description,
-                preview,
-                published,
-                modified,
-                filename,
-                image_alt
-            ) in context.execute(
-                f"""
-                SELECT User.name, Post.title, Post.description, Post.preview, Post.published, Post.modified, Post.filename, Post.image
-                FROM Post
-                JOIN User ON Post.user_id = User.user_id {'''
-                WHERE Post.post_id IN (
-                    SELECT PostTag.post_id
-                    FROM PostTag
-                    JOIN Tag ON Tag.tag_id = PostTag.tag_id
-                    WHERE LOWER(Tag.name) LIKE %s)''' if tag_filter != '' else ''}
-                ORDER BY filename DESC
-                LIMIT 5
-                OFFSET %s;""",
-                (f'%{tag_filter.lower()}%', page * 5) if tag_filter != '' else (page * 5,))]
+            main_post_metadata(post)
+            for post in context.get_posts(filenames[page * 5:page * 5 + 5])]
 
         # All relevant data for Jinja template.
         metadata = {
@@ -313,37 +914,11 @@ def index(tag_filter='', page=0):
             'now': datetime.now(),
             'csp': use_csp,
             'base': '',
-            'canonical': (
-                f"{'/' if tag_filter == '' and page == 0 else ''}"
-                f"{'' if tag_filter == '' else f'/filter/{tag_filter}'}"
-                f"{'' if page == 0 else f'/page/{page}'}"
-            ),
-            'popular': [
-                {
-                    'id': id,
-                    'image': f'/static/images/{id}.webp',
-                    'image_alt': all_posts[id]['alt'],
-                    'title': all_posts[id]['title'],
-                    'description': all_posts[id]['description']
-                }
-                for id in get_popular_posts()],
+            'canonical': f"/search?{urlencode({ 'q': query })}{'' if page == 0 else f'&page={page}'}",  # pylint: disable=line-too-long
             'tags': top_tags,
-            'filter': tag_filter,
-            'archive': context.generate_archive_dict(),
-            'month_names': {
-                '01': 'January',
-                '02': 'February',
-                '03': 'March',
-                '04': 'April',
-                '05': 'May',
-                '06': 'June',
-                '07': 'July',
-                '08': 'August',
-                '09': 'September',
-                '10': 'October',
-                '11': 'November',
-                '12': 'December'
-            },
+            'filter': '',
+            'search': query,
+            **sidebar_metadata(top_tags, ''),
             'page': page,
             'last': last_page,
             'posts': main_posts,
@@ -357,160 +932,213 @@ def index(tag_filter='', page=0):
             return render_template('500_db.html', metadata=http500_db_metadata), 500
         raise
 
-@app.route('/post/<int:post_id>')
-def show_post(post_id):
-    """Show a post from the database."""
-    try:
-        # Prereqs for Jinja metadata.
-        res = context.execute(
-            # pylint: disable=line-too-long
-            """
-            SELECT post_id, user_id, title, description, preview, content, published, modified, filename, image
-            FROM Post
-            WHERE filename = %s;""",
-            (post_id,))
-        if not res:  # Post does not exist
-            return render_template('404_post.html', metadata=http404_post_metadata), 404
-        # Unpack data
-        post_id, user_id, title, description, preview, content, published, modified, filename, image_alt = res[0]  # pylint: disable=line-too-long
+FEED_MAX_AGE = int(environ.get('FEED_MAX_AGE', '900'))
+# Full feeds carry whole posts, so only the newest ones, to stay well within the artifact cache
+FULL_FEED_ITEMS = int(environ.get('FULL_FEED_ITEMS', '20'))
+artifact_cache = LRUCache(
+    int(environ.get('ARTIFACT_CACHE_BYTES', str(16 * 1024 * 1024))),
+    sizeof=lambda artifact: len(artifact['body']) + len(artifact['gzip']))
 
-        all_posts = context.get_all_posts_sidebar()
-        # Alternate idea to get both tags_sql and the post in one query:
-        #
-        # SELECT Post.post_id, Post.title, ..., Tag.name
-        # FROM Post
-        # LEFT JOIN PostTag ON Post.post_id = PostTag.post_id
-        # LEFT JOIN Tag ON PostTag.tag_id = Tag.tag_id
-        # WHERE Post.filename = %s;
-        #
-        # Which creates something like the table below.
-        #
-        # +---------+------------------------------------+--------------+
-        # | post_id | title                              | name         |
-        # +---------+------------------------------------+--------------+
-        # |      19 | Confidentiality in the Digital Age | learning     |
-        # |      19 | Confidentiality in the Digital Age | cryptography |
-        # |      19 | Confidentiality in the Digital Age | privacy      |
-        # +---------+------------------------------------+--------------+
-        author = context.get_user(user_id)
-        image = Image.open(f'static/images/{filename}.webp')
-        md_body = markdown.markdown(
-            content,
-            extensions=["fenced_code", HeadingShiftExtension(), HeadingLinkExtension()])
+feed_item_cache = LRUCache(int(environ.get('FEED_ITEM_CACHE_BYTES', str(32 * 1024 * 1024))))
 
-        # All relevant data for Jinja template.
-        metadata = {
-            'config': config,
-            'now': datetime.now(),
-            'csp': use_csp,
-            'base': f'post/{filename}',
-            'canonical': f'/post/{filename}',
-            'popular': [
-                {
-                    'id': id,
-                    'image': f'/static/images/{id}.webp',
-                    'image_alt': all_posts[id]['alt'],
-                    'title': all_posts[id]['title'],
-                    'description': all_posts[id]['description']
-                }
-                for id in get_popular_posts()],
-            'tags': [
-                row[0]
-                for row in context.execute(
-                    f"""
-                        SELECT Tag.name
-                        FROM PostTag
-                        JOIN Tag ON PostTag.tag_id = Tag.tag_id
-                        WHERE PostTag.post_id = {post_id};
-                    """,     # Not explicitly optimized
-                    tuple()) # Should do the WHERE first...
-            ],
-            'filter': '',
-            'archive': context.generate_archive_dict(),
-            'month_names': {
-                '01': 'January',
-                '02': 'February',
-                '03': 'March',
-                '04': 'April',
-                '05': 'May',
-                '06': 'June',
-                '07': 'July',
-                '08': 'August',
-                '09': 'September',
-                '10': 'October',
-                '11': 'November',
-                '12': 'December'
-            },
-            'title': title,
-            'description': description,
-            'author': author,
+metrics.register_cache('artifacts', artifact_cache)
+metrics.register_cache('feed_items', feed_item_cache)
+
+def serve_artifact(key: tuple, mimetype: str, render) -> Response:
+    """Serve pre-serialized (and pre-gzipped) output of render, only called again when key changes.
+
+    render must return the document and the time its contents were last modified.
+    """
+    artifact = artifact_cache.get(key)
+    if artifact is None:
+        text, last_modified = render()
+        body = text.encode()
+        artifact = {
+            'body': body,
+            'gzip': gzip.compress(body, 9),
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': last_modified.astimezone()
+        }
+        artifact_cache.put(key, artifact)
+
+    if 'gzip' in request.accept_encodings:
+        response = Response(artifact['gzip'], mimetype=mimetype)
+        response.content_encoding = 'gzip'
+        response.set_etag(f"{artifact['etag']}-gzip")
+    else:
+        response = Response(artifact['body'], mimetype=mimetype)
+        response.set_etag(artifact['etag'])
+    response.vary.add('Accept-Encoding')
+    response.last_modified = artifact['last_modified']
+    response.cache_control.public = True
+    response.cache_control.max_age = FEED_MAX_AGE
+    return response.make_conditional(request)
+
+def feed_item_metadata(filename: str, summary: dict, size: int, post: Post | None) -> dict:
+    """Jinja metadata for a single RSS item, with the whole post if it is given."""
+    return {
+        'config': config,
+        'post': {
+            'title': summary['title'],
+            'id': filename,
+            'description': summary['description'],
+            'content': render_post_markdown(filename, post.modified, post.content).replace(']]>', ']]]]><![CDATA[>') if post else '',  # pylint: disable=line-too-long
             'image': {
                 'url': f'/static/images/{filename}.webp',
-                'width': image.size[0],
-                'height': image.size[1],
-                'alt': image_alt
+                'size': size
             },
-            'preview': preview,
-            'published': published.astimezone().replace(microsecond=0).isoformat(),
-            'modified': modified.astimezone().replace(microsecond=0).isoformat(),
-            'content': md_body
+            'published': summary['published'].astimezone().replace(microsecond=0).isoformat(),
+            'modified': summary['modified'].astimezone().replace(microsecond=0).isoformat(),
+            'author': post.author if post else '',
+            'tags': post.tags if post else []
         }
-        return render_template('post.html', metadata=metadata)
+    }
 
-    except MySQLdb.OperationalError as _e:
-        if _e.args[0] == 2002:
-            redlog('Could not connect to database!')
-            return render_template('500_db.html', metadata=http500_db_metadata), 500
-        raise
+def render_feed(filenames: list[str], tag_filter: str, full: bool) -> tuple[str, datetime]:  # pylint: disable=too-many-locals
+    """Render an RSS feed of the given posts, reusing the XML of items that haven't changed.
 
-@app.route('/rss')
-def rss():
-    """Generate RSS feed of blog posts."""
-    posts = sorted(
-        [
-            {
-                'title': post['title'],
-                'id': id,
-                'description': post['description'],
-                'image': {
-                    'url': f'/static/images/{id}.webp',
-                    'size': 0
-                },
-                'published': post['published'].astimezone().replace(microsecond=0).isoformat(),
-                'modified': post['modified'].astimezone().replace(microsecond=0).isoformat(),
-                'raw_published': post['published'],
-                'author': 'NOT SPECIFIED',
-                'tags': []
-            }
-            for id, post in context.get_all_posts_sidebar().items()
-        ],
-        key=lambda x: x['id'],
-        reverse=True)
+    Summary feeds are built from the sidebar posts, full feeds only load the posts whose items need
+    to be rendered again.
+    """
+    all_posts = context.get_all_posts_sidebar()
+    post_tags = context.get_post_tags() if full else {}
+    filenames = [filename for filename in filenames if filename in all_posts]
+    items = {}
+    missing = []
+    for filename in filenames:
+        size = (image_index.get(filename) or { 'size': 0 })['size']
+        key = ('rss-item', filename, all_posts[filename]['modified'], size, full, post_tags.get(filename))  # pylint: disable=line-too-long
+        item = feed_item_cache.get(key)
+        if item is None:
+            missing.append((filename, key, size))
+        else:
+            items[filename] = item
+    posts = { post.filename: post for post in context.get_posts([filename for filename, _, _ in missing]) } if full and missing else {}  # pylint: disable=line-too-long
+    for filename, key, size in missing:
+        post = posts.get(filename)
+        if full and post is None:
+            continue  # Deleted since the sidebar posts were loaded
+        items[filename] = render_template(
+            'feed_item.rss',
+            metadata=feed_item_metadata(filename, all_posts[filename], size, post))
+        feed_item_cache.put(key, items[filename])
+    last_modified = max((all_posts[filename]['modified'] for filename in filenames), default=datetime.now())  # pylint: disable=line-too-long
+    published = all_posts[filenames[0]]['published'] if filenames else last_modified
 
     metadata = {
         'config': config,
-        'now': datetime.now(),
-        'now': datetime.now().astimezone().strftime('%a, %d %h %Y %H:%M:%S %z'),
-        'published': posts[0]['raw_published'].astimezone().strftime('%a, %d %h %Y %H:%M:%S %z'),
+        'now': last_modified.astimezone().strftime('%a, %d %h %Y %H:%M:%S %z'),
+        'published': published.astimezone().strftime('%a, %d %h %Y %H:%M:%S %z'),
+        'self': request.path,
+        'filter': tag_filter,
         'image': {
             'url': '/static/icon.webp'
         },
-        'posts': posts
+        'items': [items[filename] for filename in filenames if filename in items]
     }
-    return Response(render_template('feed.rss', metadata=metadata), mimetype='application/rss+xml')
+    return render_template('feed.rss', metadata=metadata), last_modified
+
+@app.route('/rss')
+@app.route('/rss/full')
+@app.route('/filter/<tag_filter>/rss')
+@app.route('/filter/<tag_filter>/rss/full')
+def rss(tag_filter=''):
+    """Generate RSS feed of blog posts, optionally limited to a tag or with full post contents.
+
+    Full feeds only have the newest FULL_FEED_ITEMS posts.
+    """
+    full = request.path.endswith('/full')
+    filenames = context.find_tagged_posts(tag_filter) if tag_filter != '' else context.get_post_filenames()  # pylint: disable=line-too-long
+    if full:
+        filenames = filenames[:FULL_FEED_ITEMS]
+    return serve_artifact(
+        (
+            request.path,
+            context.cache['all_posts'].version,
+            context.cache['tag_index'].version if tag_filter != '' or full else 0
+        ),
+        'application/rss+xml',
+        lambda: render_feed(filenames, tag_filter, full))
+
+def render_archive_month(year: str, month: str, posts: dict) -> tuple[str, datetime]:
+    """Render the (non-empty) posts of one archive month as JSON, for the sidebar to load on demand."""  # pylint: disable=line-too-long
+    return json.dumps([
+        {
+            'id': f'{year}{month}{short_id}',
+            'title': post['title'],
+            'description': post['description'],
+            'alt': post['alt'],
+            'image': assets.url(f'images/{year}{month}{short_id}.webp'),
+            'srcset': image_srcset(f'{year}{month}{short_id}')
+        }
+        for short_id, post in posts.items()]), max(post['modified'] for post in posts.values())
+
+@app.route('/archive/<year_month>.json')
+def archive_month(year_month):
+    """Posts published in a month (given as YYYYMM), for the sidebar archive."""
+    year, month = year_month[:4], year_month[4:]
+    context.get_all_posts_sidebar()  # Loads the posts if needed, so the version below is current
+    version = context.cache['all_posts'].version
+    # The month may be gone by now if its posts were deleted after the sidebar was rendered
+    posts = context.generate_archive_dict().get(year, {}).get(month)
+    if len(year_month) != 6 or not posts:
+        return Response('Not Found', status=404)
+    return serve_artifact(
+        ('archive', year_month, version),
+        'application/json',
+        functools.partial(render_archive_month, year, month, posts))
+
+def render_sitemap() -> tuple[str, datetime]:
+    """Render sitemap of every post."""
+    all_posts = context.get_all_posts_sidebar()
+    posts = [
+        {
+            'id': id,
+            'modified': all_posts[id]['modified'].astimezone().replace(microsecond=0).isoformat()
+        }
+        for id in context.get_post_filenames()]
+    last_modified = max((post['modified'] for post in all_posts.values()), default=datetime.now())
+    return render_template('sitemap.xml', posts=posts, metadata={ 'config': config }), last_modified
 
 @app.route('/sitemap.xml')
 def sitemap():
-    """Generate RSS feed of blog posts."""
-    posts = sorted(
-        [
-            {
-                'id': id,
-                'modified': post['modified'].astimezone().replace(microsecond=0).isoformat()
-            }
-            for id, post in context.get_all_posts_sidebar().items()
-        ],
-        key=lambda x: x['id'],
-        reverse=True)
+    """Generate sitemap of blog posts."""
+    context.get_all_posts_sidebar()  # Loads the posts if needed, so the version below is current
+    return serve_artifact(
+        ('sitemap', context.cache['all_posts'].version),
+        'application/xml',
+        render_sitemap)
+
+def warm_up():
+    """Fill caches and import the Markdown library ahead of the first request.
 
-    return Response(render_template('sitemap.xml', posts=posts, metadata={ 'config': config }), mimetype='application/xml')
+    When uWSGI loads the app in the master process (the default, without lazy-apps), this runs once
+    before the workers are forked, so they all start warm and share the memory copy-on-write.
+    """
+    import md_ext  # pylint: disable=import-outside-toplevel,unused-import
+    image_index.build()
+    try:
+        context.generate_archive_dict()
+        context.get_top_tags()
+        context.cache['tag_index'].get()
+        context.update_search_index()
+        context.check_for_changes()
+        get_popular_posts()
+    except MySQLdb.OperationalError as _e:
+        redlog(f'Could not warm up caches: {_e}')
+    finally:
+        # Forked workers must not share database connections
+        context.pool.close()
+
+def create_app():
+    """Finish setting up the app, warming it up first if WARM_UP is true.
+
+    Nothing here connects to the database unless warming up, so the app can start (and show the
+    database error page) even while MySQL is down.
+    """
+    if environ.get('WARM_UP', 'false').lower() == 'true':
+        warm_up()
+    return app
+
+# For uWSGI
+application = create_app()
@@ -0,0 +1,207 @@
+"""Optional ASGI entry point, serving the main pages and posts with an async MySQL driver.
+
+Run it with any ASGI server instead of uWSGI, e.g.:
+
+    uvicorn asgi:application --workers 2
+
+The main pages and posts make up most of the traffic, and are the pages that query MySQL whenever
+they aren't in the page cache. They are handled on the event loop with a pool of aiomysql
+connections, so a worker waiting on the database keeps serving other requests, and the queries a
+page needs are issued concurrently. Everything else, and any request that fails with a database
+error (so the error page is shown), is passed on to the Flask app, which runs in a thread.
+
+The in-memory caches (post list, tags, search index, ...) are still filled in threads with the
+blocking client, as they are refreshed in the background and rarely make a request wait.
+"""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from os import environ
+
+import aiomysql
+import MySQLdb
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date
+from werkzeug.sansio.http import is_resource_modified
+
+import app as blog
+import metrics
+
+class AsyncConnectionPool:
+    """Pool of aiomysql connections, created by the first query (once the event loop runs)."""
+
+    def __init__(self, credentials: dict, size: int):
+        """Prepare an empty pool, connections are opened on demand."""
+        self.credentials = credentials
+        self.size = size
+        self.pool = None
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        """Create the pool, unless another request already did."""
+        async with self.lock:
+            if self.pool is None:
+                self.pool = await aiomysql.create_pool(
+                    minsize=0,
+                    maxsize=self.size,
+                    host=self.credentials['host'],
+                    user=self.credentials['user'],
+                    password=self.credentials['password'],
+                    db=self.credentials['database'],
+                    # Without autocommit every SELECT leaves a transaction open, and the pool would
+                    # close the connection instead of reusing it
+                    autocommit=True,
+                    init_command='SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED;')
+
+    async def close(self):
+        """Close every connection owned by the pool."""
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    async def execute(self, query: str, tokens: tuple) -> tuple:
+        """Run a query on a pooled connection, waiting for one while all of them are in use."""
+        if self.pool is None:
+            await self.open()
+        try:
+            async with self.pool.acquire() as connection:
+                if blog.log_sql:
+                    blog.redlog(f'executing query {query}')
+                async with connection.cursor() as cursor:
+                    with metrics.timed('query'):
+                        await cursor.execute(query, tokens)
+                        return await cursor.fetchall()
+        except aiomysql.OperationalError as _e:
+            if _e.args[0] in (2006, 2013):
+                # The pool doesn't reuse closed connections
+                blog.redlog('Lost database connection, attempting reconnect.')
+                return await self.execute(query, tokens)
+            raise
+
+db = AsyncConnectionPool(blog.context.credentials, int(environ.get('MYSQL_POOL_SIZE', '4')))
+wsgi = WsgiToAsgi(blog.app)
+urls = blog.app.url_map.bind('localhost')
+
+async def query_posts(where: str, tokens: tuple, limit: str = '', full: bool = True) -> list[blog.Post]:  # pylint: disable=line-too-long
+    """Load posts with their author and tags in a single query, newest first.
+
+    Only full posts are cached, listings leave out the contents.
+    """
+    rows = await db.execute(blog.posts_query(where, limit, full), tokens)
+    return blog.context.store_posts(rows) if full else [blog.Post(row) for row in rows]
+
+def rendered(render, *args) -> tuple[str, int]:
+    """Call one of the app's render functions inside its context (run in a thread)."""
+    with blog.app.app_context():
+        result = render(*args)
+    return result if isinstance(result, tuple) else (result, 200)
+
+async def index(tag_filter='', page=0) -> tuple[str, int]:
+    """Main page, counting and loading its posts at the same time if both need MySQL."""
+    def prereqs():
+        return blog.get_top_tags(tag_filter), blog.index_queries(tag_filter, page)
+
+    top_tags, (where, tokens, last_page, count_query) = await asyncio.to_thread(prereqs)
+    queries = [query_posts(where, tokens, 'LIMIT 5 OFFSET %s', full=False)]
+    if count_query is not None:
+        queries.append(db.execute(*count_query))
+    posts, *count = await asyncio.gather(*queries)
+    if count:
+        last_page = (count[0][0][0] - 1) // 5
+    return await asyncio.to_thread(
+        rendered, blog.render_index, tag_filter, page, top_tags, last_page, posts)
+
+async def show_post(post_id) -> tuple[str, int]:
+    """A post's page, only querying MySQL if the post isn't cached."""
+    filename = str(post_id)
+    found, missing = await asyncio.to_thread(blog.context.cached_posts, [filename])
+    post = found.get(filename)
+    if missing:
+        posts = await query_posts('WHERE Post.filename = %s', (filename,))
+        post = posts[0] if posts else None
+    return await asyncio.to_thread(rendered, blog.render_post, post)
+
+views = {
+    'index': index,
+    'show_post': show_post
+}
+
+def page_version() -> tuple[str, datetime]:
+    """Check for new posts (like the app does before every request) and fingerprint the pages."""
+    blog.context.check_for_changes()
+    return blog.content_version()
+
+def header(scope: dict, name: bytes) -> str | None:
+    """Value of a request header, or None."""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+async def cached_page(scope: dict, view, kwargs: dict) -> tuple[int, list, bytes]:
+    """Serve a view from the app's page cache, answering conditional requests with 304 Not Modified."""  # pylint: disable=line-too-long
+    version, last_modified = await asyncio.to_thread(page_version)
+    etag = hashlib.sha1(f"{scope['path']}:{version}".encode()).hexdigest()
+    headers = [(b'content-type', b'text/html; charset=utf-8')]
+
+    entry = blog.page_cache.get(scope['path'])
+    if entry is None or entry[0] != etag:
+        html, status = await view(**kwargs)
+        if status != 200:
+            return status, headers, html.encode()
+        entry = (etag, 'text/html', html.encode())
+        blog.page_cache.put(scope['path'], entry)
+
+    headers += [
+        (b'etag', f'"{etag}"'.encode()),
+        (b'last-modified', http_date(last_modified).encode()),
+        (b'cache-control', b'no-cache')]
+    # Same rules as Response.make_conditional in the Flask app: If-None-Match, else If-Modified-Since
+    if not is_resource_modified(
+            http_if_modified_since=header(scope, b'if-modified-since'),
+            http_if_none_match=header(scope, b'if-none-match'),
+            etag=etag,
+            last_modified=last_modified):
+        return 304, headers, b''
+    return 200, headers, entry[2]
+
+async def lifespan(receive, send):
+    """Close the database connections when the server shuts down."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({ 'type': 'lifespan.startup.complete' })
+        elif message['type'] == 'lifespan.shutdown':
+            await db.close()
+            await send({ 'type': 'lifespan.shutdown.complete' })
+            return
+
+async def application(scope, receive, send):
+    """ASGI application, handling main pages and posts itself and passing the rest to Flask."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    endpoint, kwargs = None, {}
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        try:
+            endpoint, kwargs = urls.match(scope['path'], method='GET')
+        except HTTPException:
+            pass
+    if endpoint not in views:
+        await wsgi(scope, receive, send)
+        return
+
+    start = time.perf_counter()
+    try:
+        status, headers, body = await cached_page(scope, views[endpoint], kwargs)
+    except (aiomysql.OperationalError, MySQLdb.OperationalError):
+        await wsgi(scope, receive, send)  # Shows the database error page, or raises
+        return
+    metrics.inc('blog_requests_total', endpoint=endpoint, status=status)
+    metrics.inc('blog_request_seconds_total', time.perf_counter() - start, endpoint=endpoint)
+    await send({ 'type': 'http.response.start', 'status': status, 'headers': headers })
+    await send({ 'type': 'http.response.body', 'body': body })
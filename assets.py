@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""Content-hashed, pre-compressed copies of the static assets.
+
+Running this module copies every file under static/ to static/dist/ with a hash of its contents in
+the name (blog.css -> blog.1a2b3c4d5e.css), writes .gz (and .br, if the brotli module is installed)
+copies of text assets, and records the mapping in static/dist/manifest.json. Since a hashed URL
+can never change content, browsers may cache it forever. Run it again whenever static/ changes.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC = 'static'
+DIST = os.path.join(STATIC, 'dist')
+MANIFEST = os.path.join(DIST, 'manifest.json')
+COMPRESSIBLE = { '.css', '.js', '.json', '.svg', '.txt', '.xml' }
+
+manifest = {}
+
+def load_manifest():
+    """Read the manifest written by the last build, if there is one."""
+    try:
+        with open(MANIFEST, 'r', encoding='utf-8') as file:
+            manifest.update(json.load(file))
+    except FileNotFoundError:
+        pass
+
+def url(name: str) -> str:
+    """URL of a static file, the hashed copy if it has been built."""
+    return f'/static/{manifest.get(name, name)}'
+
+def hashed_name(name: str, data: bytes) -> str:
+    """Path under static/ for the hashed copy of name."""
+    root, ext = os.path.splitext(name)
+    return f'dist/{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+def write_compressed(target: str, data: bytes):
+    """Write .gz (and .br, if brotli is installed) copies of data next to target."""
+    with open(f'{target}.gz', 'wb') as file:
+        file.write(gzip.compress(data, 9))
+    if brotli is not None:
+        with open(f'{target}.br', 'wb') as file:
+            file.write(brotli.compress(data))
+
+def write(name: str, data: bytes):
+    """Write a hashed copy of name, plus compressed copies if worthwhile."""
+    target = os.path.join(STATIC, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as file:
+        file.write(data)
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        write_compressed(target, data)
+
+def build():
+    """Rebuild static/dist from scratch."""
+    shutil.rmtree(DIST, ignore_errors=True)
+    names = []
+    for directory, subdirectories, files in os.walk(STATIC):
+        subdirectories[:] = [sub for sub in subdirectories if os.path.join(directory, sub) != DIST]
+        names += [os.path.relpath(os.path.join(directory, file), STATIC) for file in files]
+
+    result = {}
+    stylesheets = []
+    for name in sorted(names):
+        if name.endswith('.css'):
+            stylesheets.append(name)  # Done last, they may refer to other assets
+            continue
+        with open(os.path.join(STATIC, name), 'rb') as file:
+            data = file.read()
+        result[name] = hashed_name(name, data)
+        write(result[name], data)
+
+    for name in stylesheets:
+        with open(os.path.join(STATIC, name), 'r', encoding='utf-8') as file:
+            text = file.read()
+        text = re.sub(
+            r'/static/([^)\'"\s]+)',
+            lambda match: f'/static/{result.get(match[1], match[1])}',
+            text)
+        data = text.encode()
+        result[name] = hashed_name(name, data)
+        write(result[name], data)
+
+    with open(MANIFEST, 'w', encoding='utf-8') as file:
+        json.dump(result, file, indent='\t')
+    print(f'Built {len(result)} assets into {DIST}')
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+"""Load test the blog against a synthetic dataset, reporting latency percentiles and throughput.
+
+By default no MySQL server is needed: a small stand-in for the MySQLdb module, backed by SQLite, is
+installed before the app is imported, and seeded with thousands of posts and tags, a large
+access.log and generated images, all inside a temporary directory. Requests are made through the
+Flask test client from several threads. Pass --url to load test a running server (e.g. uWSGI)
+instead; it must be serving the same dataset for the post/filter routes to make sense.
+
+Results can be saved with --save and later compared with --compare, which exits with status 1 if
+the median latency of any route got worse by more than --tolerance.
+
+--markdown instead times rendering a single large post: with the separate heading shift and heading
+link processors the app used to have (and a new engine per call), with a new engine per call, with
+the reused per-thread engine of md_ext.convert, and with plain Markdown without any heading
+processor as the floor for all of them.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+    'labore et dolore magna aliqua linux python server database compiler kernel network').split()
+TAGS = [f'{word}{n}' for n in range(4) for word in WORDS[:10]]
+
+def sqlite_mysqldb(path: str) -> types.ModuleType:
+    """A module with just enough of the MySQLdb interface for the app, backed by a SQLite file."""
+    module = types.ModuleType('MySQLdb')
+
+    class Error(Exception):
+        """Base class of the stand-in's errors."""
+
+    class OperationalError(Error):
+        """Raised for any SQLite error, with a MySQL-style (code, message) args tuple."""
+
+    class Cursor:
+        """Translates the MySQL dialect used by the app into SQLite."""
+
+        def __init__(self, db):
+            self.cursor = db.cursor()
+
+        def execute(self, query, args=()):
+            """Run a query, ignoring session settings."""
+            if query.lstrip().startswith('SET '):
+                return
+            query = query.replace('%s', '?')
+            query = re.sub(r"GROUP_CONCAT\((.+?) SEPARATOR '\\n'\)", r'GROUP_CONCAT(\1, char(10))', query)  # pylint: disable=line-too-long
+            try:
+                self.cursor.execute(query, args)
+            except sqlite3.Error as _e:
+                raise OperationalError(1105, str(_e)) from _e
+
+        def fetchall(self):
+            """All rows of the last query."""
+            return tuple(self.cursor.fetchall())
+
+        def close(self):
+            """Close the cursor."""
+            self.cursor.close()
+
+    class Connection:
+        """SQLite connection usable from whichever thread borrows it."""
+
+        def __init__(self):
+            self.db = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)  # pylint: disable=line-too-long
+            self.db.create_function('CONCAT', -1, lambda *args: ''.join(str(arg) for arg in args))
+            self.db.create_function('CRC32', 1, lambda text: zlib.crc32(str(text).encode()))
+
+        def cursor(self):
+            """New cursor."""
+            return Cursor(self.db)
+
+        def ping(self):
+            """SQLite connections don't go away."""
+
+        def close(self):
+            """Close the connection."""
+            self.db.close()
+
+    module.Error = Error
+    module.OperationalError = OperationalError
+    module.connect = lambda **_credentials: Connection()
+    return module
+
+def seed(directory: str, posts: int, log_lines: int, images: int) -> dict:
+    """Create the synthetic database, access log and images, returning what routes can request."""
+    rng = random.Random(0)
+    sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+    db = sqlite3.connect(os.path.join(directory, 'blog.sqlite'))
+    db.executescript("""
+        CREATE TABLE User (user_id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE Post (
+            post_id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, description TEXT, preview TEXT,
+            content TEXT, published DATETIME, modified DATETIME, filename TEXT UNIQUE, image TEXT);
+        CREATE TABLE Tag (tag_id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE PostTag (post_id INTEGER, tag_id INTEGER, PRIMARY KEY (post_id, tag_id));
+        INSERT INTO User VALUES (1, 'Matthew Rease'), (2, 'Guest Author');""")
+    db.executemany('INSERT INTO Tag VALUES (?, ?)', enumerate(TAGS, 1))
+
+    def sentence(count):
+        return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+    filenames = []
+    published = datetime(2020, 1, 1)
+    for post_id in range(1, posts + 1):
+        published += timedelta(hours=rng.randint(1, 48))
+        filename = published.strftime('%Y%m%d%H%M')
+        filenames.append(filename)
+        content = '\n\n'.join(
+            f'# {sentence(4)}\n\n{sentence(120)}\n\n```\n{sentence(20)}\n```\n\n## {sentence(3)}\n\n{sentence(80)}'  # pylint: disable=line-too-long
+            for _ in range(rng.randint(2, 8)))
+        db.execute(
+            'INSERT INTO Post VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (post_id, 1 if rng.random() < 0.9 else 2, sentence(5).title(), sentence(12),
+             f'<p>{sentence(40)}</p>', content, published.isoformat(' '),
+             (published + timedelta(days=rng.randint(0, 30))).isoformat(' '), filename,
+             sentence(6)))
+        db.executemany(
+            'INSERT INTO PostTag VALUES (?, ?)',
+            [
+                (post_id, tag_id)
+                for tag_id in rng.sample(range(1, len(TAGS) + 1), rng.randint(1, 4))])
+    db.commit()
+    db.close()
+
+    with open(os.path.join(directory, 'access.log'), 'w', encoding='utf-8') as log:
+        for _ in range(log_lines):
+            log.write(f'127.0.0.1 GET 200 /post/{rng.choice(filenames)} Mozilla/5.0\n')
+
+    os.makedirs(os.path.join(directory, 'static', 'images'))
+    if images:
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+        for filename in filenames[-images:]:
+            Image.new('RGB', (320, 200), tuple(rng.randrange(256) for _ in range(3))).save(
+                os.path.join(directory, 'static', 'images', f'{filename}.webp'))
+
+    return { 'filenames': filenames, 'tags': TAGS }
+
+def routes(dataset: dict) -> dict:
+    """Route name -> function picking a random path for it."""
+    filenames = dataset['filenames']
+    pages = (len(filenames) - 1) // 5
+    return {
+        'index': lambda rng: '/',
+        'index_page': lambda rng: f'/page/{rng.randint(1, pages)}',
+        'filter': lambda rng: f"/filter/{rng.choice(dataset['tags'])}",
+        'filter_page': lambda rng: f"/filter/{rng.choice(dataset['tags'])}/page/1",
+        'show_post': lambda rng: f'/post/{rng.choice(filenames)}',
+        'search': lambda rng: f'/search?q={rng.choice(WORDS)}+{rng.choice(WORDS)}',
+        'rss': lambda rng: '/rss',
+        'sitemap': lambda rng: '/sitemap.xml'
+    }
+
+def run(get, dataset: dict, threads: int, requests: int) -> dict:
+    """Hammer each route with requests spread over threads, returning latency statistics."""
+    results = {}
+    for name, pick in routes(dataset).items():
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(seed_value, count, pick=pick, latencies=latencies, lock=lock):  # pylint: disable=dangerous-default-value,line-too-long
+            rng = random.Random(seed_value)
+            local = []
+            for _ in range(count):
+                path = pick(rng)
+                start = time.perf_counter()
+                status = get(path)
+                local.append(time.perf_counter() - start)
+                if status != 200:
+                    print(f'{path} returned HTTP {status}', file=sys.stderr)
+            with lock:
+                latencies.extend(local)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            for future in [pool.submit(worker, n, requests // threads) for n in range(threads)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        results[name] = {
+            'p50_ms': quantiles[49] * 1000,
+            'p99_ms': quantiles[98] * 1000,
+            'rps': len(latencies) / elapsed
+        }
+        print(f"{name:>12}: p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms  {results[name]['rps']:8.1f} req/s")  # pylint: disable=line-too-long
+    return results
+
+def old_heading_extension():
+    """Build the two heading processors md_ext had before they were merged, as a baseline."""
+    import xml.etree.ElementTree  # pylint: disable=import-outside-toplevel
+    from markdown.extensions import Extension  # pylint: disable=import-outside-toplevel
+    from markdown.treeprocessors import Treeprocessor  # pylint: disable=import-outside-toplevel
+
+    class HeadingShiftProcessor(Treeprocessor):  # pylint: disable=too-few-public-methods
+        """Find all <h> elements and increase their level."""
+
+        def run(self, root):
+            """Walk the whole tree once to shift headings."""
+            for element in root.iter():
+                if element.tag.startswith('h') and element.tag[1:].isdigit():
+                    element.tag = f'h{int(element.tag[1:]) + 2}'
+
+    class HeadingLinkProcessor(Treeprocessor):  # pylint: disable=too-few-public-methods
+        """Add clickable and hyperlinkable IDs to every heading."""
+
+        def run(self, root):
+            """Walk the whole tree again to add an anchor with its own ID to every heading."""
+            for element in root.iter():
+                if element.tag in { 'h1', 'h2', 'h3', 'h4', 'h5', 'h6' }:
+                    text = re.sub(r'[^a-zA-Z0-9 ]', '', element.text).replace(' ', '-').lower()
+                    anchor = xml.etree.ElementTree.Element(
+                        'a',
+                        attrib={
+                            'href': f'#{text}',
+                            'id': text,
+                            'class': 'markdown-heading',
+                            'aria-label': 'Direct link to this heading.' })
+                    anchor.text = '#'
+                    anchor.tail = f' {element.text}'
+                    element.text = None
+                    element.insert(0, anchor)
+
+    class OldHeadingExtension(Extension):
+        """Register both processors, with their old priorities."""
+
+        def extendMarkdown(self, md):
+            """Register extension in the Markdown engine."""
+            md.treeprocessors.register(HeadingShiftProcessor(md), 'shiftheadings', 15)
+            md.treeprocessors.register(HeadingLinkProcessor(md), 'linkheadings', 14)
+
+    return OldHeadingExtension()
+
+def markdown_benchmark(sections: int, rounds: int):
+    """Time rendering one large post with the old heading processors, a fresh Markdown engine per call, a reused one and none of our extensions."""  # pylint: disable=line-too-long
+    import markdown  # pylint: disable=import-outside-toplevel
+    import md_ext  # pylint: disable=import-outside-toplevel
+    rng = random.Random(0)
+
+    def sentence(count):
+        return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+    content = '\n\n'.join(
+        f'# {sentence(4)}\n\n{sentence(120)}\n\n```\n{sentence(20)}\n```\n\n## Using `{rng.choice(WORDS)}`\n\n{sentence(80)}\n\n### Summary\n\n{sentence(40)}'  # pylint: disable=line-too-long
+        for _ in range(sections))
+    print(f'Rendering a {len(content) // 1024} KiB post with {sections * 3} headings')
+    for name, render in (
+            ('old pipeline', lambda: markdown.markdown(content, extensions=['fenced_code', old_heading_extension()])),  # pylint: disable=line-too-long
+            ('fresh engine', lambda: markdown.markdown(content, extensions=['fenced_code', md_ext.HeadingExtension()])),  # pylint: disable=line-too-long
+            ('reused engine', lambda: md_ext.convert(content)),
+            ('no headings', lambda: markdown.markdown(content, extensions=['fenced_code']))):
+        render()
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            render()
+            latencies.append(time.perf_counter() - start)
+        print(f'{name:>13}: median {statistics.median(latencies) * 1000:8.2f} ms  min {min(latencies) * 1000:8.2f} ms')  # pylint: disable=line-too-long
+
+def main():
+    """Parse arguments, set up the dataset and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--posts', type=int, default=2000, help='number of posts to generate')
+    parser.add_argument('--log-lines', type=int, default=200000, help='number of access.log lines to generate')  # pylint: disable=line-too-long
+    parser.add_argument('--images', type=int, default=2000, help='number of (newest) posts to generate images for')  # pylint: disable=line-too-long
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=400, help='requests per route')
+    parser.add_argument('--no-page-cache', action='store_true', help='disable the full-page cache, to measure rendering')  # pylint: disable=line-too-long
+    parser.add_argument('--url', help='load test a running server at this base URL instead')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare against results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative p50 slowdown when comparing')  # pylint: disable=line-too-long
+    parser.add_argument('--markdown', type=int, metavar='SECTIONS', help='only time Markdown rendering of a post this many sections long')  # pylint: disable=line-too-long
+    args = parser.parse_args()
+
+    if args.markdown:
+        markdown_benchmark(args.markdown, args.requests)
+        return
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as directory:
+        print(f'Seeding {args.posts} posts into {directory}')
+        dataset = seed(directory, args.posts, args.log_lines, args.images)
+
+        if args.url:
+            def get(path):
+                try:
+                    with urllib.request.urlopen(args.url.rstrip('/') + path) as response:
+                        response.read()
+                        return response.status
+                except urllib.error.HTTPError as _e:
+                    return _e.code
+        else:
+            sys.modules['MySQLdb'] = sqlite_mysqldb(os.path.join(directory, 'blog.sqlite'))
+            sys.path.insert(0, repo)
+            os.environ.setdefault('USE_CSP', 'false')
+            os.environ['POPULARITY_STATE'] = os.path.join(directory, 'popularity.json')
+            os.environ['SEARCH_INDEX'] = os.path.join(directory, 'search.json')
+            if args.no_page_cache:
+                os.environ['PAGE_CACHE_BYTES'] = '0'
+            os.chdir(directory)  # The app reads access.log and static/images relative to it
+            import app  # pylint: disable=import-outside-toplevel
+            local = threading.local()
+
+            def get(path):
+                if not hasattr(local, 'client'):
+                    local.client = app.app.test_client()
+                return local.client.get(path).status_code
+
+        results = run(get, dataset, args.threads, args.requests)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent='\t')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = [
+            f"{name}: p50 {baseline[name]['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms"
+            for name, result in results.items()
+            if name in baseline and result['p50_ms'] > baseline[name]['p50_ms'] * (1 + args.tolerance)]  # pylint: disable=line-too-long
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""Caching helpers shared by the blog."""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+class LRUCache:  # pylint: disable=too-many-instance-attributes
+    """Thread-safe least-recently-used cache, bounded by the total size of its values.
+
+    If a directory is given, entries are also written there as files, so they survive restarts and
+    can be shared between uWSGI workers. The directory is held to max_size bytes as well, by
+    deleting the least recently used files.
+    """
+
+    def __init__(self, max_size: int, directory: str | None = None, sizeof=len):
+        """Create an empty cache holding at most max_size worth of values, as measured by sizeof."""
+        self.max_size = max_size
+        self.directory = directory
+        self.sizeof = sizeof
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key) -> str:
+        """Location of the on-disk copy of key."""
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key):
+        """Retrieve value for key, or None if it isn't cached."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.directory:
+            try:
+                with open(self.path(key), 'r', encoding='utf-8') as file:
+                    value = file.read()
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            try:
+                os.utime(self.path(key))  # Recently used, so pruned last
+            except FileNotFoundError:
+                pass
+            self.hits += 1
+            self.put(key, value, persist=False)
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, persist: bool = True):
+        """Store value under key, evicting the least recently used entries if needed."""
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizeof(self.entries.pop(key))
+            if size <= self.max_size:
+                self.entries[key] = value
+                self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+        if persist and self.directory:
+            path = self.path(key)
+            # Forked workers can have threads with the same ident, so the PID is part of the name
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(value)
+            os.replace(tmp_path, path)
+            self.prune()
+
+    def prune(self):
+        """Delete the least recently used files while the directory holds over max_size bytes."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if '.tmp' in entry.name:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Pruned by another worker
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Forget every entry held in memory."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+class SQLiteBackend:
+    """Store shared by every process on the machine, kept in a SQLite file."""
+
+    def __init__(self, path: str):
+        """Use (and create, if needed) the database at path."""
+        self.path = path
+        self.local = threading.local()
+
+    def db(self) -> sqlite3.Connection:
+        """Connection for the current thread (and process, connections must not survive a fork)."""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self.local.db.execute('PRAGMA journal_mode=WAL')
+            self.local.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB)')  # pylint: disable=line-too-long
+            self.local.db.execute('CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER)')  # pylint: disable=line-too-long
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def get(self, key: str) -> bytes | None:
+        """Stored value, or None."""
+        row = self.db().execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes) -> bool:
+        """Store value under key, returning whether that worked."""
+        self.db().execute('INSERT OR REPLACE INTO entries VALUES (?, ?)', (key, value))
+        return True
+
+    def delete(self, key: str):
+        """Remove key."""
+        self.db().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def version(self, key: str) -> int:
+        """Current version counter of key."""
+        row = self.db().execute('SELECT version FROM versions WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key: str) -> int:
+        """Bump the version counter of key, returning the new version."""
+        self.db().execute(
+            'INSERT INTO versions VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET version = version + 1',  # pylint: disable=line-too-long
+            (key,))
+        return self.version(key)
+
+class UWSGIBackend:
+    """Store shared by every worker of a uWSGI instance, using its caching framework.
+
+    The cache has to be configured in uWSGI, with blocks big enough for the post list, for example:
+    cache2 = name=blog,items=512,blocksize=65536,bitmap=1
+    """
+
+    def __init__(self, cache: str):
+        """Use the uWSGI cache with the given name."""
+        import uwsgi  # pylint: disable=import-outside-toplevel,import-error
+        self.uwsgi = uwsgi
+        self.cache = cache
+
+    def get(self, key: str) -> bytes | None:
+        """Stored value, or None."""
+        return self.uwsgi.cache_get(key, self.cache)
+
+    def set(self, key: str, value: bytes) -> bool:
+        """Store value under key, returning False if it didn't fit in a cache block."""
+        return bool(self.uwsgi.cache_update(key, value, 0, self.cache))
+
+    def delete(self, key: str):
+        """Remove key."""
+        self.uwsgi.cache_del(key, self.cache)
+
+    def version(self, key: str) -> int:
+        """Current version counter of key."""
+        if not self.uwsgi.cache_exists(f'{key}:version', self.cache):
+            return 0
+        return self.uwsgi.cache_num(f'{key}:version', self.cache)
+
+    def incr(self, key: str) -> int:
+        """Bump the version counter of key, returning the new version."""
+        self.uwsgi.cache_inc(f'{key}:version', 1, 0, self.cache)
+        return self.version(key)
+
+def open_backend(spec: str):
+    """Create the shared store described by spec ('sqlite:<path>' or 'uwsgi:<cache name>').
+
+    An empty spec returns None, meaning every process keeps its own caches.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'sqlite':
+        return SQLiteBackend(argument or 'cache.sqlite')
+    if kind == 'uwsgi':
+        return UWSGIBackend(argument or 'blog')
+    if kind:
+        raise ValueError(f'Unknown cache backend {spec!r}')
+    return None
+
+refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-refresh')
+
+class RefreshingValue:  # pylint: disable=too-many-instance-attributes
+    """Value produced by a loader, which is served stale while a background thread reloads it.
+
+    Only the very first load happens in the calling thread. After that, reads never wait: once the
+    value is older than ttl, a single refresh is queued on the background worker and the old value
+    keeps being returned until it finishes.
+
+    With a shared backend, every load is published under name along with a version counter. Other
+    processes notice the new version on their next read and adopt the published value instead of
+    calling the loader themselves.
+    """
+
+    def __init__(self, loader, ttl: timedelta, backend=None, name: str = '', on_change=None):
+        """Wrap loader, which isn't called until the value is first needed.
+
+        on_change is called after a background reload in this process changed the value.
+        """
+        self.loader = loader
+        self.on_change = on_change
+        self.ttl = ttl
+        self.backend = backend
+        self.name = name
+        self.value = None
+        self.loaded = None
+        self.version = 0  # Bumped whenever a (re)load changes the value
+        self.shared_version = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.hits = 0
+        self.misses = 0  # Reads that had to wait for the loader
+
+    def get(self):
+        """Current value, loading it now if this is the first request."""
+        if self.backend is not None:
+            self.sync()
+        if self.loaded is None:
+            with self.lock:
+                if self.loaded is None:
+                    self.misses += 1
+                    self.value = self.loader()
+                    self.loaded = datetime.now()
+                    self.version += 1
+                    self.publish()
+            return self.value
+        self.hits += 1
+        if datetime.now() - self.loaded > self.ttl:
+            self.refresh()
+        return self.value
+
+    def sync(self):
+        """Adopt the value published by another process, if the shared version changed."""
+        shared_version = self.backend.version(self.name)
+        if shared_version == self.shared_version:
+            return
+        self.shared_version = shared_version
+        record = self.backend.get(self.name)
+        if record is None:
+            # Invalidated elsewhere
+            if self.loaded is not None:
+                self.loaded = datetime.min
+            return
+        loaded, value = pickle.loads(record)
+        if value != self.value:
+            self.value = value
+            self.version += 1
+        self.loaded = loaded
+
+    def publish(self):
+        """Share the current value with other processes.
+
+        The version is only bumped once the value was stored, as a new version without a record
+        means the value was invalidated, and every other process would reload it.
+        """
+        if self.backend is not None:
+            if self.backend.set(self.name, pickle.dumps((self.loaded, self.value))):
+                self.shared_version = self.backend.incr(self.name)
+            else:
+                print(f'Could not share cached {self.name}, is the backend big enough?')
+
+    def refresh(self):
+        """Queue a background reload, unless one is already pending."""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        refresher.submit(self.reload)
+
+    def reload(self):
+        """Call the loader and swap in its result (run by the background worker)."""
+        try:
+            value = self.loader()
+            changed = value != self.value
+            if changed:
+                self.value = value
+                self.version += 1
+            self.loaded = datetime.now()
+            self.publish()
+            if changed and self.on_change is not None:
+                self.on_change()
+        except Exception as _e:  # pylint: disable=broad-exception-caught
+            print(f'Background cache refresh failed: {_e!r}')
+        finally:
+            self.refreshing = False
+
+    def invalidate(self):
+        """Mark the value as expired (in every process), so the next read triggers a refresh."""
+        if self.loaded is not None:
+            self.loaded = datetime.min
+        if self.backend is not None:
+            self.backend.delete(self.name)
+            self.backend.incr(self.name)
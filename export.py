@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+"""Export the whole blog as a static tree of files, for serving directly from nginx.
+
+Every page is requested through the Flask app, so the output is exactly what the dynamic site
+would serve. Next to each file, .gz (and .br, if the brotli module is installed) copies are written
+for nginx's gzip_static/brotli_static. HTML pages are written as <path>/index.html, and the feeds as
+<path>/index.xml, so a location block like this serves everything:
+
+    try_files $uri $uri/index.html $uri/index.xml =404;
+
+Post pages are only rendered again when the post, its tags or image (or what the sidebar shows)
+changed since the previous export, unless --full is given. Files of pages that no longer exist
+(e.g. deleted posts) are removed.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import app
+import assets
+
+MANIFEST = '.export.json'
+client = None  # pylint: disable=invalid-name
+
+def write_file(target: str, data: bytes):
+    """Write data to target, along with compressed copies."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as file:
+        file.write(data)
+    assets.write_compressed(target, data)
+
+def export_page(output: str, path: str) -> tuple[str, int]:
+    """Request a page from the app and write it into the output tree (run in worker processes)."""
+    global client  # pylint: disable=global-statement
+    if client is None:
+        client = app.app.test_client()
+    response = client.get(path)
+    if response.status_code == 200:
+        if os.path.splitext(path)[1]:
+            target = f'{output}{path}'
+        elif response.mimetype == 'text/html':
+            target = f'{output}{path.rstrip("/")}/index.html'
+        else:
+            target = f'{output}{path}/index.xml'
+        write_file(target, response.get_data())
+    return path, response.status_code
+
+def remove_page(output: str, path: str):
+    """Delete whichever files export_page could have written for path, and its emptied directory."""
+    if os.path.splitext(path)[1]:
+        targets = [f'{output}{path}']
+    else:
+        targets = [f'{output}{path.rstrip("/")}/index.html', f'{output}{path}/index.xml']
+    for target in targets:
+        for suffix in ('', '.gz', '.br'):
+            try:
+                os.remove(f'{target}{suffix}')
+            except FileNotFoundError:
+                pass
+    try:
+        os.rmdir(os.path.dirname(targets[-1]))
+    except OSError:
+        pass  # Other pages live below it, or it's the output directory
+
+def list_pages() -> dict[str, str | None]:
+    """Every path of the site, mapped to a fingerprint of its content (None to always render)."""
+    context = app.context
+    all_posts = context.get_all_posts_sidebar()
+    filenames = context.get_post_filenames()
+    post_tags = context.get_post_tags()
+    sidebar = hashlib.sha1(repr((
+        [(id, all_posts[id]['title'], all_posts[id]['description'], all_posts[id]['alt']) for id in filenames],  # pylint: disable=line-too-long
+        app.get_popular_posts(),
+        context.get_top_tags())).encode()).hexdigest()
+
+    pages = { '/': None, '/rss': None, '/rss/full': None, '/sitemap.xml': None }
+    for page in range((len(filenames) - 1) // 5 + 1):
+        pages[f'/page/{page}'] = None
+    for filename in filenames:
+        pages[f'/post/{filename}'] = hashlib.sha1(repr((
+            all_posts[filename]['modified'].isoformat(),
+            sorted(post_tags.get(filename, ())),
+            app.image_index.get(filename),
+            sidebar)).encode()).hexdigest()
+    for year, months in context.generate_archive_dict().items():
+        for month in months:
+            pages[f'/archive/{year}{month}.json'] = None
+    for (tag,) in context.execute('SELECT name FROM Tag;', tuple()):
+        if '/' in tag:
+            continue
+        pages[f'/filter/{tag}'] = None
+        pages[f'/filter/{tag}/rss'] = None
+        pages[f'/filter/{tag}/rss/full'] = None
+        for page in range((len(context.find_tagged_posts(tag)) - 1) // 5 + 1):
+            pages[f'/filter/{tag}/page/{page}'] = None
+    return pages
+
+def main():
+    """Parse arguments and export the site."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('output', help='directory to write the site to')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')  # pylint: disable=line-too-long
+    parser.add_argument('--full', action='store_true', help='render every page, even unchanged posts')  # pylint: disable=line-too-long
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    manifest = {}
+    try:
+        with open(os.path.join(output, MANIFEST), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    pages = list_pages()
+    todo = [path for path, fingerprint in pages.items() if args.full or fingerprint is None or manifest.get(path) != fingerprint]  # pylint: disable=line-too-long
+    gone = [path for path in manifest if path not in pages]
+    print(f'Exporting {len(todo)} of {len(pages)} pages to {output}, removing {len(gone)}')
+    for path in gone:
+        remove_page(output, path)
+
+    shutil.copytree('static', os.path.join(output, 'static'), dirs_exist_ok=True)
+    # Spawn instead of fork, so workers don't share this process' database connections
+    with ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for path, status in pool.map(export_page, [output] * len(todo), todo, chunksize=8):
+            if status != 200:
+                app.redlog(f'{path} returned HTTP {status}')
+                pages[path] = None
+
+    with open(os.path.join(output, MANIFEST), 'w', encoding='utf-8') as file:
+        json.dump(pages, file)
+
+if __name__ == '__main__':
+    main()
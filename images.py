@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""Post image bookkeeping.
+
+Running this module generates smaller variants of every post image (see VARIANT_WIDTHS), which are
+offered to browsers through srcset. Variants are only regenerated when their source image changes.
+"""
+
+import argparse
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+VARIANT_WIDTHS: list[int] = [
+    100,  # thumb, shown 50px wide in the sidebar
+    800   # card, the width of a post on most screens
+]
+
+def variant_path(directory: str, image_id: str, width: int) -> str:
+    """Location of a resized copy of an image."""
+    return os.path.join(directory, 'variants', f'{image_id}-{width}.webp')
+
+class ImageIndex:
+    """Dimensions and byte size of every image in a directory, refreshed when an mtime changes."""
+
+    def __init__(self, directory: str):
+        """Create an empty index of directory."""
+        self.directory = directory
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Index every webp image in the directory up front."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith('.webp'):
+                self.get(name[:-5])
+
+    def get(self, image_id: str) -> dict | None:
+        """Get width, height, size, mtime and available variant widths of an image, or None if it doesn't exist."""  # pylint: disable=line-too-long
+        path = os.path.join(self.directory, f'{image_id}.webp')
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.images.pop(image_id, None)
+            return None
+        try:
+            variants_mtime = os.stat(os.path.join(self.directory, 'variants')).st_mtime_ns
+        except FileNotFoundError:
+            variants_mtime = 0
+
+        info = self.images.get(image_id)
+        if (info is not None and info['mtime'] == stat.st_mtime_ns and info['size'] == stat.st_size
+                and info['variants_mtime'] == variants_mtime):
+            return info
+
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+        with Image.open(path) as image:
+            width, height = image.size
+        info = {
+            'width': width,
+            'height': height,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'variants': [
+                variant
+                for variant in VARIANT_WIDTHS
+                if variant < width
+                and os.path.isfile(variant_path(self.directory, image_id, variant))
+                and os.stat(variant_path(self.directory, image_id, variant)).st_mtime_ns >= stat.st_mtime_ns],  # pylint: disable=line-too-long
+            'variants_mtime': variants_mtime
+        }
+        with self.lock:
+            self.images[image_id] = info
+        return info
+
+def make_variant(source: str, target: str, width: int):
+    """Write a copy of source scaled down to width (run in worker processes)."""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+    with Image.open(source) as image:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        resized.save(f'{target}.tmp', 'WEBP', quality=80)
+    os.replace(f'{target}.tmp', target)
+    return target
+
+def generate_variants(directory: str, jobs: int | None = None):
+    """Create missing or outdated variants of every image in directory, using a process pool."""
+    os.makedirs(os.path.join(directory, 'variants'), exist_ok=True)
+    index = ImageIndex(directory)
+    tasks = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.webp'):
+            continue
+        image_id = name[:-5]
+        info = index.get(image_id)
+        for width in VARIANT_WIDTHS:
+            target = variant_path(directory, image_id, width)
+            if width < info['width'] and (not os.path.isfile(target) or os.stat(target).st_mtime_ns < info['mtime']):  # pylint: disable=line-too-long
+                tasks.append((os.path.join(directory, name), target, width))
+
+    print(f'Generating {len(tasks)} image variants')
+    with ProcessPoolExecutor(jobs) as pool:
+        for target in pool.map(make_variant, *zip(*tasks)) if tasks else ():
+            print(target)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate resized variants of post images.')
+    parser.add_argument('directory', nargs='?', default='static/images', help='image directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+    generate_variants(args.directory, args.jobs)
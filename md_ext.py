@@ -1,57 +1,83 @@
 """Markdown extensions."""
 
 import re
+import threading
 import xml.etree.ElementTree
 
+import markdown
 from markdown.extensions import Extension
 from markdown.treeprocessors import Treeprocessor
+from markdown.util import ETX, STX
 
-class HeadingShiftProcessor(Treeprocessor):  # pylint: disable=too-few-public-methods
-    """Find all <h> elements and increase their level."""
+HEADING_TAGS = { 'h1', 'h2', 'h3', 'h4', 'h5', 'h6' }
+PLACEHOLDER_PATTERN = re.compile(f'{STX}[^{ETX}]*{ETX}')
+SLUG_PATTERN = re.compile(r'[^a-zA-Z0-9 ]')
+
+class HeadingProcessor(Treeprocessor):  # pylint: disable=too-few-public-methods
+    """Shift every heading down a few levels and give it a clickable and hyperlinkable ID."""
+
+    def __init__(self, md, shift: int):
+        """Remember how many levels to shift headings by."""
+        super().__init__(md)
+        self.shift = shift
 
     def run(self, root):
-        """Largely adapted from ChatGPT."""
+        """Update every heading in a single pass over the tree.
+
+        IDs are made from the heading's text (including any inline markup), with -1, -2, ... added
+        when the same text was already used by an earlier heading.
+        """
+        slugs = set()
         for element in root.iter():
-            if element.tag.startswith('h') and element.tag[1:].isdigit():
-                level = int(element.tag[1:])
-                element.tag = f'h{level + 2}'
+            if element.tag not in HEADING_TAGS:
+                continue
+            element.tag = f'h{min(int(element.tag[1:]) + self.shift, 6)}'
 
-class HeadingShiftExtension(Extension):
-    """Extend Markdown library with heading shifter."""
+            # Heading text, normalized
+            text = PLACEHOLDER_PATTERN.sub('', ''.join(element.itertext()))
+            slug = base = SLUG_PATTERN.sub('', text).replace(' ', '-').lower()
+            count = 0
+            while slug in slugs:
+                count += 1
+                slug = f'{base}-{count}'
+            slugs.add(slug)
 
-    def extendMarkdown(self, md):
-        """Register extension in the Markdown engine."""
-        # Priority arbitrarily chosen by ChatGPT...
-        md.treeprocessors.register(HeadingShiftProcessor(md), 'shiftheadings', 15)
+            # Link element
+            anchor = xml.etree.ElementTree.Element(
+                'a',
+                attrib={
+                    'href': f'#{slug}',
+                    'id': slug,
+                    'class': 'markdown-heading',
+                    'aria-label': 'Direct link to this heading.' })
+            anchor.text = '#'
 
-class HeadingLinkProcessor(Treeprocessor):  # pylint: disable=too-few-public-methods
-    """Add clickable and hyperlinkable IDs to every heading."""
+            # Update heading element
+            anchor.tail = f" {element.text or ''}"
+            element.text = None
+            element.insert(0, anchor)
 
-    def run(self, root):
-        """Add anchor with self id to every heading."""
-        for element in root.iter():
-            if element.tag in { 'h1', 'h2', 'h3', 'h4', 'h5', 'h6' }:
-                # Heading text, normalized
-                text = re.sub(r'[^a-zA-Z0-9 ]', '', element.text).replace(' ', '-').lower()
-
-                # Link element
-                anchor = xml.etree.ElementTree.Element(
-                    'a',
-                    attrib={
-                        'href': f'#{text}',
-                        'id': text,
-                        'class': 'markdown-heading',
-                        'aria-label': 'Direct link to this heading.' })
-                anchor.text = '#'
-
-                # Update heading element
-                anchor.tail = f' {element.text}'
-                element.text = None
-                element.insert(0, anchor)
-
-class HeadingLinkExtension(Extension):
-    """Extend Markdown library with heading links."""
+class HeadingExtension(Extension):
+    """Extend Markdown library with shifted, linkable headings."""
+
+    def __init__(self, shift: int = 2, **kwargs):
+        """Headings are shifted down by shift levels (h1 becomes h3 by default)."""
+        super().__init__(**kwargs)
+        self.shift = shift
 
     def extendMarkdown(self, md):
         """Register extension in the Markdown engine."""
-        md.treeprocessors.register(HeadingLinkProcessor(md), 'linkheadings', 14)
+        # After inline markup was processed (20), before the output is prettified (10)
+        md.treeprocessors.register(HeadingProcessor(md, self.shift), 'headings', 15)
+
+local = threading.local()
+
+def convert(text: str) -> str:
+    """Render Markdown to HTML, reusing this thread's engine instead of building one per call."""
+    md = getattr(local, 'md', None)
+    if md is None:
+        md = local.md = markdown.Markdown(extensions=['fenced_code', HeadingExtension()])
+    try:
+        return md.convert(text)
+    finally:
+        md.reset()
@@ -0,0 +1,107 @@
+"""Request timing and cache instrumentation, exposed in Prometheus text format.
+
+Counters are kept per process, so with several uWSGI workers each one reports its own numbers.
+"""
+
+import hmac
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import before_render_template, g, has_request_context, request, Response, template_rendered  # pylint: disable=line-too-long
+
+lock = threading.Lock()
+counters = defaultdict(float)  # (metric, (label, value) pairs) -> value
+caches = {}
+
+def inc(metric: str, value: float = 1.0, **labels):
+    """Add value to a counter."""
+    with lock:
+        counters[(metric, tuple(sorted(labels.items())))] += value
+
+def register_cache(name: str, cache):
+    """Report hits and misses of a cache (anything with hits and misses attributes)."""
+    caches[name] = cache
+
+@contextmanager
+def timed(kind: str):
+    """Count and time a block of work, also attributing it to the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        inc(f'blog_{kind}_total')
+        inc(f'blog_{kind}_seconds_total', elapsed)
+        if has_request_context() and 'timing' in g:
+            g.timing[kind][0] += 1
+            g.timing[kind][1] += elapsed
+
+def render() -> str:
+    """All metrics in Prometheus text format."""
+    lines = []
+    with lock:
+        items = list(counters.items())
+    for name, cache in caches.items():
+        items.append((('blog_cache_hits_total', (('cache', name),)), cache.hits))
+        items.append((('blog_cache_misses_total', (('cache', name),)), cache.misses))
+    # Every sample of a metric has to follow its TYPE line, which may only appear once
+    items.sort(key=lambda item: (item[0][0], repr(item[0][1])))
+    last = None
+    for (metric, labels), value in items:
+        if metric != last:
+            lines.append(f'# TYPE {metric} counter')
+            last = metric
+        label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+        lines.append(f'{metric}{{{label_text}}} {value}' if labels else f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+def init_app(app, server_timing: bool, token: str):
+    """Instrument every request of app and add the /metrics endpoint.
+
+    /metrics is only answered to local requests bearing token, and not at all without one: behind a
+    reverse proxy on the same machine every request comes from localhost.
+    """
+    @app.before_request
+    def start_timing():
+        g.timing = defaultdict(lambda: [0, 0.0])
+        g.timing_start = time.perf_counter()
+
+    @app.after_request
+    def finish_timing(response):
+        if 'timing' not in g:
+            return response
+        elapsed = time.perf_counter() - g.timing_start
+        inc('blog_requests_total', endpoint=request.endpoint, status=response.status_code)
+        inc('blog_request_seconds_total', elapsed, endpoint=request.endpoint)
+        if server_timing:
+            response.headers['Server-Timing'] = ', '.join([
+                *(
+                    f'{kind};dur={seconds * 1000:.2f};desc="{count}"'
+                    for kind, (count, seconds) in g.timing.items()),
+                f'total;dur={elapsed * 1000:.2f}'])
+        return response
+
+    def template_started(_sender, **_extra):
+        if has_request_context() and 'timing' in g:
+            g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def template_finished(_sender, **_extra):
+        if has_request_context() and g.get('template_starts'):
+            elapsed = time.perf_counter() - g.template_starts.pop()
+            inc('blog_template_total')
+            inc('blog_template_seconds_total', elapsed)
+            g.timing['template'][0] += 1
+            g.timing['template'][1] += elapsed
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics, for local scrapers with the token only."""
+        if (not token or request.remote_addr not in ('127.0.0.1', '::1')
+                or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')):  # pylint: disable=line-too-long
+            return Response('Not Found', status=404)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
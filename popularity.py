@@ -0,0 +1,89 @@
+"""Incremental popularity tracking from the uWSGI access log."""
+
+import json
+import os
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+class PopularityCounter:
+    """Count post views in a rolling window of days, only reading log lines it hasn't seen before.
+
+    The byte offset into the log and the per-day counts are persisted to a small JSON state file, so
+    a restart doesn't require reading the whole log again. Rotation (a new inode) and truncation
+    (the file shrinking) are detected, after which the log is read from the start.
+    """
+
+    def __init__(self, log_path: str, state_path: str, days: int):
+        """Load previous state, if there is any."""
+        self.log_path = log_path
+        self.state_path = state_path
+        self.days = days
+        self.lock = threading.Lock()
+
+        self.inode = None
+        self.offset = 0
+        self.buckets = {}  # ISO date -> Counter of post IDs
+        try:
+            with open(state_path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            self.inode = state['inode']
+            self.offset = state['offset']
+            # Drop IDs counted by older versions along with a query string
+            self.buckets = {
+                day: Counter({ post_id: count for post_id, count in counts.items() if post_id.isdigit() })  # pylint: disable=line-too-long
+                for day, counts in state['buckets'].items() }
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    def save(self):
+        """Write state file atomically."""
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'inode': self.inode,
+                'offset': self.offset,
+                'buckets': self.buckets }, file)
+        os.replace(tmp_path, self.state_path)
+
+    def refresh(self):
+        """Parse lines appended to the log since the last refresh.
+
+        Raises FileNotFoundError if the log doesn't exist. Returns immediately if another thread is
+        already refreshing.
+        """
+        if not self.lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return
+        try:
+            with open(self.log_path, 'rb') as log:
+                stat = os.fstat(log.fileno())
+                if stat.st_ino != self.inode or stat.st_size < self.offset:
+                    self.inode = stat.st_ino
+                    self.offset = 0
+                log.seek(self.offset)
+
+                today = self.buckets.setdefault(date.today().isoformat(), Counter())
+                for line in log:
+                    if not line.endswith(b'\n'):
+                        break  # Still being written
+                    self.offset += len(line)
+                    if b'GET 200 /post/' in line:
+                        fields = line.split()
+                        if len(fields) > 3:
+                            # uWSGI logs the URI with its query string (e.g. ?fbclid=...)
+                            post_id = fields[3][6:].split(b'?', 1)[0]
+                            if post_id.isdigit():
+                                today[post_id.decode()] += 1
+
+            oldest = (date.today() - timedelta(days=self.days - 1)).isoformat()
+            self.buckets = { day: counts for day, counts in self.buckets.items() if day >= oldest }
+            self.save()
+        finally:
+            self.lock.release()
+
+    def most_common(self, count: int) -> list[str]:
+        """Most viewed post IDs within the window."""
+        total = Counter()
+        for counts in list(self.buckets.values()):
+            total.update(counts)
+        return [key for key, _ in total.most_common(count)]
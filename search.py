@@ -0,0 +1,126 @@
+"""Full-text search over posts, using an in-memory inverted index."""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+# How much more a match in each field counts than one in the post's content
+FIELD_WEIGHTS = {
+    'title': 5,
+    'tags': 4,
+    'description': 3,
+    'preview': 2,
+    'content': 1
+}
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words, ignoring HTML tags and single characters."""
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(TAG_PATTERN.sub(' ', text).lower())
+        if len(token) > 1]
+
+class SearchIndex:
+    """Ranked full-text search over posts, only tokenizing posts that changed since the last update.
+
+    Every post's weighted term frequencies are kept along with its modified time, and persisted to a
+    JSON state file, so a restart only has to read posts that were published or edited since. The
+    inverted index (term -> post -> weight) is rebuilt from those when loading.
+    """
+
+    def __init__(self, state_path: str):
+        """Load previous state, if there is any."""
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.source = None  # Sidebar posts and tags the index was last updated from
+
+        self.documents = {}  # Filename -> (modified time as ISO string, {term: weight})
+        self.postings = {}  # Term -> {filename: weight}
+        try:
+            with open(state_path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            self.documents = { filename: tuple(document) for filename, document in state['documents'].items() }  # pylint: disable=line-too-long
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+            pass
+        for filename, (_, terms) in self.documents.items():
+            for term, weight in terms.items():
+                self.postings.setdefault(term, {})[filename] = weight
+
+    def save(self):
+        """Write state file atomically."""
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({ 'documents': self.documents }, file)
+        os.replace(tmp_path, self.state_path)
+
+    def remove(self, filename: str):
+        """Drop a post from the index (call with the lock held)."""
+        _, terms = self.documents.pop(filename)
+        for term in terms:
+            posts = self.postings[term]
+            del posts[filename]
+            if not posts:
+                del self.postings[term]
+
+    def add(self, filename: str, modified: str, fields: dict[str, str]):
+        """Tokenize a post's fields and add it to the index (call with the lock held)."""
+        terms = Counter()
+        for field, text in fields.items():
+            for token in tokenize(text):
+                terms[token] += FIELD_WEIGHTS[field]
+        self.documents[filename] = (modified, dict(terms))
+        for term, weight in terms.items():
+            self.postings.setdefault(term, {})[filename] = weight
+
+    def update(self, source, modified: dict[str, str], load):
+        """Bring the index up to date with the given modified times of every post.
+
+        load is called with the filenames of new or edited posts, and must return (filename, fields)
+        pairs for them. Does nothing if source equals the one the index was last updated from.
+        """
+        if source == self.source:
+            return
+        with self.lock:
+            if source == self.source:
+                return  # Another thread just did it
+            changed = [
+                filename
+                for filename, timestamp in modified.items()
+                if filename not in self.documents or self.documents[filename][0] != timestamp]
+            removed = [filename for filename in self.documents if filename not in modified]
+            for filename in removed:
+                self.remove(filename)
+            for filename, fields in load(changed) if changed else ():
+                if filename in self.documents:
+                    self.remove(filename)
+                self.add(filename, modified[filename], fields)
+            if changed or removed:
+                self.save()
+            self.source = source
+
+    def search(self, query: str) -> list[str]:
+        """Filenames of posts containing every word of query, best match first (newest on ties).
+
+        Matches are ranked by the sum of each word's weighted frequency in the post, scaled by how
+        rare the word is across all posts (TF-IDF).
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self.lock:
+            postings = sorted((self.postings.get(term, {}) for term in terms), key=len)
+            if not postings[0]:
+                return []
+            total = len(self.documents)
+            scores = {}
+            for filename in postings[0]:
+                if all(filename in posts for posts in postings[1:]):
+                    scores[filename] = sum(
+                        posts[filename] * math.log(1 + total / len(posts))
+                        for posts in postings)
+        return sorted(scores, key=lambda filename: (scores[filename], filename), reverse=True)